@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 
 import os, sys
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+import asyncio
+import collections
+import json
+import logging
+import queue
+import re
+import select
+import signal
 import subprocess
+import threading
 import time
-import logging
-from multiprocessing import Process
+import yaml
 
 # Set up logging
 logging.getLogger().setLevel(logging.NOTSET)
+# Only show problems reported by the event loop used to monitor the executable
+logging.getLogger("asyncio").setLevel(logging.WARNING)
 
 # This script is meant for FreeRTOS PR checks, which all run using bash shells
 # So wrap the important lines in bash escaped colours.
@@ -23,216 +33,721 @@ stdout_logging_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(me
 stdout_logging_handler.setFormatter(stdout_logging_formatter)
 logging.getLogger().addHandler(stdout_logging_handler)
 
-def runAndMonitor(args):
-    # On Windows we need to add the child's logging to the global logger
-    if os.name == 'nt':
-        logging.getLogger().addHandler(stdout_logging_handler)
+# How long output is still read once the executable exited or was killed, in case
+# a process it started keeps the output pipe open.
+DRAIN_TIMEOUT_SECONDS = 1
+
+# How often the peak memory of the executable is read while it runs.
+RSS_SAMPLE_INTERVAL_MS = 50
+
+# Options that each executable of a manifest can set, with the command line option used when it doesn't,
+# and the type of their value.
+MANIFEST_OPTIONS = {
+    "name": str,
+    "exe-path": str,
+    "success-line": list,
+    "success-regex": list,
+    "failure-line": list,
+    "failure-regex": list,
+    "success-exit-code": int,
+    "timeout-seconds": int,
+    "retry-attempts": int,
+    "output-tail-lines": int,
+}
+# How each type of manifest value is described in errors.
+MANIFEST_TYPE_NAMES = {str: "a string", int: "an integer", list: "a string or a list of strings"}
+# Options that take a list of patterns, which can also be given as a single pattern.
+PATTERN_OPTIONS = ["success-line", "success-regex", "failure-line", "failure-regex"]
+
+class MonitorProtocol(asyncio.SubprocessProtocol):
+    """ Queues the executable's output and notes its exit as soon as they happen. """
+    def __init__(self, loop):
+        self.loop = loop
+        self.output = asyncio.Queue()
+        self.exited = loop.create_future()
+        self.first_output_time = None
+        self.exit_time = None
+
+    def pipe_data_received(self, fd, data):
+        if self.first_output_time is None:
+            self.first_output_time = self.loop.time()
+        self.output.put_nowait(data)
+
+    def pipe_connection_lost(self, fd, exc):
+        # An empty chunk marks the end of the output
+        self.output.put_nowait(b"")
+
+    def process_exited(self):
+        self.exit_time = self.loop.time()
+        self.exited.set_result(None)
+
+    # Used when the output pipe is connected to the event loop on its own
+    def data_received(self, data):
+        self.pipe_data_received(1, data)
+
+    def eof_received(self):
+        self.pipe_connection_lost(1, None)
+
+class Wait4Transport:
+    """ Used instead of loop.subprocess_exec() where wait4 is available. A thread waits for the
+        executable with wait4, so its CPU time is known once it exits, and follows its peak memory while it runs. """
+    def __init__(self, loop, protocol, exe_abs_path):
+        self.loop = loop
+        self.protocol = protocol
+        self.returncode = None
+        self.rusage = None
+        self.peak_rss_kb = None
+        self.pipe_transport = None
+        # Held while the executable is reaped, so kill() never signals a pid that was reused
+        self.reap_lock = threading.Lock()
+        self.reaped = False
+        self.process = subprocess.Popen([exe_abs_path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=os.environ)
+        threading.Thread(target=self.waitForExit, daemon=True).start()
+
+    async def connectOutput(self):
+        self.pipe_transport, _ = await self.loop.connect_read_pipe(lambda: self.protocol, self.process.stdout)
+
+    def waitForExit(self):
+        self.samplePeakRss()
+        # Wait for the exit without reaping the executable yet
+        os.waitid(os.P_PID, self.process.pid, os.WEXITED | os.WNOWAIT)
+        with self.reap_lock:
+            _, wait_status, rusage = os.wait4(self.process.pid, 0)
+            self.reaped = True
+        self.loop.call_soon_threadsafe(self.processExited, os.waitstatus_to_exitcode(wait_status), rusage)
+
+    def samplePeakRss(self):
+        """ Read the high-water mark of the executable's memory until it exits. The ru_maxrss of wait4 can't be
+            used for this, on Linux it includes the memory of the monitor that started the executable. """
+        if not hasattr(os, "pidfd_open"):
+            return
+        try:
+            pidfd = os.pidfd_open(self.process.pid)
+        except OSError:
+            return
+        try:
+            poller = select.poll()
+            poller.register(pidfd, select.POLLIN)
+            # The pidfd becomes readable once the executable exited
+            while True:
+                self.readPeakRss()
+                if poller.poll(RSS_SAMPLE_INTERVAL_MS):
+                    break
+        finally:
+            os.close(pidfd)
+
+    def readPeakRss(self):
+        try:
+            with open(f"/proc/{self.process.pid}/status", "r") as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        self.peak_rss_kb = max(self.peak_rss_kb or 0, int(line.split()[1]))
+        except OSError:
+            pass
+
+    def processExited(self, returncode, rusage):
+        self.returncode = returncode
+        self.rusage = rusage
+        # Let Popen know the executable was already waited for
+        self.process.returncode = returncode
+        self.protocol.process_exited()
+
+    def get_returncode(self):
+        return self.returncode
+
+    def kill(self):
+        # Popen.kill() would wait for the executable itself, which the thread does instead
+        with self.reap_lock:
+            if self.reaped:
+                return
+            try:
+                os.kill(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def close(self):
+        if self.pipe_transport is not None:
+            self.pipe_transport.close()
+        else:
+            self.process.stdout.close()
+        self.kill()
+
+async def launchExecutable(loop, exe_abs_path):
+    """ Start the executable with its output going to a MonitorProtocol. Returns the transport and protocol. """
+    if not (hasattr(os, "wait4") and hasattr(os, "waitid")):
+        # Resource usage is not available on this platform
+        return await loop.subprocess_exec(lambda: MonitorProtocol(loop), exe_abs_path, stdin=None, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, env=os.environ)
+
+    protocol = MonitorProtocol(loop)
+    transport = Wait4Transport(loop, protocol, exe_abs_path)
+    try:
+        await transport.connectOutput()
+    except BaseException:
+        transport.close()
+        raise
+    return transport, protocol
+
+def getRunTelemetry(transport, protocol, start_time, success_time):
+    """ Collect the timing and resource usage of a run of the executable. """
+    def secondsSinceStart(event_time):
+        return None if event_time is None else round(event_time - start_time, 3)
+
+    telemetry = {
+        "time_to_first_output_seconds": secondsSinceStart(protocol.first_output_time),
+        "time_to_success_line_seconds": secondsSinceStart(success_time),
+        "runtime_seconds": secondsSinceStart(protocol.exit_time),
+        "exit_code": transport.get_returncode(),
+        "peak_rss_kb": getattr(transport, "peak_rss_kb", None),
+        "user_cpu_seconds": None,
+        "system_cpu_seconds": None,
+    }
+    rusage = getattr(transport, "rusage", None)
+    if rusage is not None:
+        telemetry["user_cpu_seconds"] = round(rusage.ru_utime, 3)
+        telemetry["system_cpu_seconds"] = round(rusage.ru_stime, 3)
+    return telemetry
+
+class OutputSink:
+    """ Writes the executable's output to the handlers of a logger in batches, from its own thread.
+        Lines are not turned into log records, the log format is applied once per batch instead.
+        The last lines can be kept, to show them when a run fails without showing all the output. """
+    def __init__(self, logger, tail_lines=None):
+        self.logger = logger
+        # When only the tail is shown, the output is written to log files only
+        self.tail = collections.deque(maxlen=tail_lines) if tail_lines else None
+        self.batches = queue.Queue()
+        self.writer = threading.Thread(target=self.writeBatches, daemon=True)
+        self.writer.start()
+
+    def getHandlers(self, files):
+        return [handler for handler in self.logger.handlers
+                if isinstance(handler, logging.StreamHandler) and isinstance(handler, logging.FileHandler) == files]
+
+    def writeLines(self, lines, handlers):
+        record = logging.LogRecord(self.logger.name, logging.INFO, __file__, 0, "", None, None)
+        for handler in handlers:
+            prefix = handler.format(record)
+            text = "".join([f"{prefix}{line}{handler.terminator}" for line in lines])
+            handler.acquire()
+            try:
+                handler.stream.write(text)
+                handler.flush()
+            finally:
+                handler.release()
+
+    def writeBatches(self):
+        while True:
+            lines = self.batches.get()
+            try:
+                if lines is None:
+                    return
+                handlers = self.getHandlers(files=True)
+                if self.tail is None:
+                    handlers += self.getHandlers(files=False)
+                self.writeLines(lines, handlers)
+            finally:
+                self.batches.task_done()
+
+    def addLines(self, lines):
+        if lines:
+            if self.tail is not None:
+                self.tail.extend(lines)
+            self.batches.put(lines)
+
+    def flush(self):
+        """ Wait for every line added so far to be written, so the output stays in order with other log messages. """
+        self.batches.join()
+
+    def close(self):
+        self.batches.put(None)
+        self.writer.join()
+
+    def showTail(self):
+        """ Show the kept lines of output where the output was not written. """
+        if self.tail:
+            self.flush()
+            self.writeLines([f"LAST {len(self.tail)} LINES OF OUTPUT:"] + list(self.tail), self.getHandlers(files=False))
+
+def compileOutputPatterns(args):
+    """ Combine the success and failure patterns into one regex, so each line of output is searched once.
+        Failure patterns come first, so they win if both kinds match at the same place of a line.
+        Patterns that can't be combined, like ones with inline flags or backreferences, are searched one at a time. """
+    args.output_patterns = {}
+    args.output_regexes = []
+    alternatives = []
+    for kind, patterns, is_regex in [("failure", args.failure_line, False),
+                                     ("failure", args.failure_regex, True),
+                                     ("success", args.success_line, False),
+                                     ("success", args.success_regex, True)]:
+        for pattern in patterns or []:
+            # Report an invalid pattern on its own
+            regex = re.compile(pattern if is_regex else re.escape(pattern))
+            group_name = f"pattern_{len(args.output_patterns)}"
+            args.output_patterns[group_name] = (kind, pattern)
+            args.output_regexes.append((regex, (kind, pattern)))
+            alternatives.append(f"(?P<{group_name}>{regex.pattern})")
+    # Numbered backreferences would point at the wrong group once the patterns are combined
+    if any(re.search(r"\\[1-9]", regex.pattern) for regex, _ in args.output_regexes):
+        alternatives = []
+    try:
+        args.output_matcher = re.compile("|".join(alternatives)) if alternatives else None
+    except re.error:
+        args.output_matcher = None
+
+def matchOutputLine(args, exe_stdout_line):
+    """ Return the kind ("success" or "failure") and text of the first pattern found in the line, or None. """
+    if args.output_matcher is None:
+        # Keep the order of the combined regex: the earliest match wins, then the first pattern given
+        first_match = None
+        for regex, matched_pattern in args.output_regexes:
+            match = regex.search(exe_stdout_line)
+            if match is not None and (first_match is None or match.start() < first_match[0]):
+                first_match = (match.start(), matched_pattern)
+        return first_match[1] if first_match is not None else None
+    match = args.output_matcher.search(exe_stdout_line)
+    if match is None:
+        return None
+    for group_name, value in match.groupdict().items():
+        if value is not None and group_name in args.output_patterns:
+            return args.output_patterns[group_name]
+
+def checkOutputLines(args, sink, data, output_state, final=False):
+    """ Log each complete line of output, stopping at the first line that matches a success or failure pattern.
+        Returns the kind and text of the pattern that matched, or None, and notes when it was found. """
+    lines = ( output_state["partial_line"] + data ).split(b"\n")
+    # Unless the output ended, the last entry is the start of a line that is not complete yet
+    output_state["partial_line"] = b"" if final else lines.pop()
+    # The executable may print its last line without a newline and keep running, so check that line as well
+    if output_state["partial_line"] and matchOutputLine(args, output_state["partial_line"].decode("utf-8", errors="replace")) is not None:
+        lines.append(output_state["partial_line"])
+        output_state["partial_line"] = b""
+    output_lines = []
+    matched_pattern = None
+    for raw_line in lines:
+        exe_stdout_line = raw_line.decode("utf-8", errors="replace").rstrip("\r")
+        if len(exe_stdout_line.strip()) <= 1:
+            continue
+        # Check if the executable printed out a success or failure line
+        matched_pattern = matchOutputLine(args, exe_stdout_line)
+        if matched_pattern is not None:
+            break
+        output_lines.append(exe_stdout_line)
+
+    sink.addLines(output_lines)
+    if matched_pattern is not None:
+        output_state["match_time"] = asyncio.get_running_loop().time()
+        sink.flush()
+        if matched_pattern[0] == "success":
+            sink.logger.info(f"{bashPass}SUCCESS_LINE_FOUND: {exe_stdout_line}{bashEnd}")
+        else:
+            sink.logger.error(f"{bashFail}FAILURE_LINE_FOUND: {exe_stdout_line}{bashEnd}")
+    return matched_pattern
+
+async def readOutput(args, sink, protocol, output_state, deadline):
+    """ Read output as it arrives until a success or failure line is found, the output ends or the deadline passes.
+        Returns the kind and text of the pattern that matched, or None. Output is only read for
+        DRAIN_TIMEOUT_SECONDS more once the executable exits. """
+    loop = asyncio.get_running_loop()
+    exit_seen = False
+    while True:
+        if protocol.exited.done() and not exit_seen:
+            deadline = min(deadline, loop.time() + DRAIN_TIMEOUT_SECONDS)
+            exit_seen = True
+
+        if output_state["read_task"] is None:
+            output_state["read_task"] = asyncio.ensure_future(protocol.output.get())
+        read_task = output_state["read_task"]
+
+        waiting_on = {read_task} if exit_seen else {read_task, protocol.exited}
+        done, _ = await asyncio.wait(waiting_on, timeout=max(deadline - loop.time(), 0), return_when=asyncio.FIRST_COMPLETED)
+        if read_task in done:
+            output_state["read_task"] = None
+            data = read_task.result()
+            matched_pattern = checkOutputLines(args, sink, data, output_state, final=not data)
+            # Stop once a pattern matched or all output has been read
+            if matched_pattern is not None or not data:
+                return matched_pattern
+        elif not done:
+            return None
+
+async def monitorExecutable(args, logger, sink, exe_abs_path):
+    """ Run the executable until an exit condition is met or the timeout is hit.
+        Returns whether it exited by itself, its exit status, the kind and text of the pattern that
+        matched its output, if any, and the telemetry of the run. """
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    deadline = start_time + args.timeout_seconds
+    output_state = {"partial_line": b"", "read_task": None, "match_time": None}
 
+    # Launch the executable
+    transport, protocol = await launchExecutable(loop, exe_abs_path)
+
+    logger.info("START OF EXECUTABLE OUTPUT\n")
+
+    try:
+        matched_pattern = await readOutput(args, sink, protocol, output_state, deadline)
+        sink.flush()
+        if matched_pattern is None:
+            # All output has been read, give the executable the rest of the timeout to exit
+            await asyncio.wait({protocol.exited}, timeout=max(deadline - loop.time(), 0))
+
+        exe_exitted = protocol.exited.done()
+        if exe_exitted:
+            logger.info(f"EXECUTABLE CLOSED WITH STATUS: {transport.get_returncode()}")
+        elif matched_pattern is not None:
+            # We found a success or failure line, kill the executable
+            transport.kill()
+        else:
+            logger.info(f"TIMEOUT OF {args.timeout_seconds} SECONDS HIT")
+            logger.info(f"EXECUTABLE DID NOT EXIT, MANUALLY KILLING NOW")
+            transport.kill()
+            logger.info(f"PARSING REST OF LOG")
+            # Capture remaining output and check for the successful line
+            matched_pattern = await readOutput(args, sink, protocol, output_state, loop.time() + DRAIN_TIMEOUT_SECONDS)
+            if matched_pattern is None:
+                # Check the last line even if the output did not end
+                matched_pattern = checkOutputLines(args, sink, b"", output_state, final=True)
+            sink.flush()
+
+        await protocol.exited
+        success_time = output_state["match_time"] if matched_pattern is not None and matched_pattern[0] == "success" else None
+        telemetry = getRunTelemetry(transport, protocol, start_time, success_time)
+        return exe_exitted, transport.get_returncode(), matched_pattern, telemetry
+    finally:
+        if output_state["read_task"] is not None:
+            output_state["read_task"].cancel()
+        # Stop reading output that a process started by the executable may still write
+        transport.close()
+
+async def runAndMonitor(args, logger):
+    """ Run the executable once. Returns 0 if it met one of the success conditions, and the telemetry of the run. """
     exe_abs_path = os.path.abspath(args.exe_path)
-    if args.log_dir is not None:
-        log_dir = os.path.abspath(args.log_dir)
-        # Create log directory if it does not exist.
-        if not os.path.exists(args.log_dir):
-            os.makedirs(args.log_dir, exist_ok = True)
-
-        # Add file handler to output logging to a log file
-        exe_name = os.path.basename(exe_abs_path)
-        log_file_path = f'{log_dir}/{exe_name}_output.txt'
-        file_logging_handler = logging.FileHandler(log_file_path)
-        file_logging_handler.setLevel(logging.DEBUG)
-        file_logging_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_logging_handler.setFormatter(file_logging_formatter)
-        logging.getLogger().addHandler(file_logging_handler)
-        logging.info(f"Storing logs in: {log_dir}")
-
-    # Initialize values
-    exe_exit_status = None
-    exe_exitted = False
-    success_line_found = False
-    exit_condition_met = False
+    sink = OutputSink(logger, args.output_tail_lines)
+    try:
+        exe_exitted, exe_exit_status, matched_pattern, telemetry = await monitorExecutable(args, logger, sink, exe_abs_path)
+    finally:
+        sink.close()
+    success_line_searched = bool(args.success_line or args.success_regex)
+    failure_line_found = ( matched_pattern is not None ) and ( matched_pattern[0] == "failure" )
 
-    # Launch the executable
-    exe = subprocess.Popen([exe_abs_path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, env=os.environ)
-
-    cur_time_seconds = time.time()
-    timeout_time_seconds = cur_time_seconds + args.timeout_seconds
-
-    logging.info("START OF EXECUTABLE OUTPUT\n")
-
-    # While a timeout hasn't happened, the executable is running, and an exit condition has not been met
-    while ( not exit_condition_met ):
-        # Check if executable exitted
-        exe_exit_status = exe.poll()
-        if (exe_exit_status is not None) and (exe_exitted is False):
-            logging.info(f"EXECUTABLE CLOSED WITH STATUS: {exe_exit_status}")
-            exe_exitted = True
-            exit_condition_met = True
-
-        exe_stdout_line = exe.stdout.readline()
-        if(exe_stdout_line is not None) and (len(exe_stdout_line.strip()) > 1):
-            # Check if the executable printed out its success line
-            if ( args.success_line is not None ) and ( args.success_line in exe_stdout_line ) :
-                logging.info(f"SUCCESS_LINE_FOUND: {exe_stdout_line}")
-                # Mark that we found the success line, kill the executable
-                success_line_found = True
-                exit_condition_met = True
-                exe.kill()
-                time.sleep(.05)
-            else:
-                # Making an assumption that device output is adding a \n already
-                logging.info(exe_stdout_line.rstrip("\r\n"))
-
-        # Check for timeout
-        cur_time_seconds = time.time()
-        if cur_time_seconds >= timeout_time_seconds:
-            logging.info(f"TIMEOUT OF {args.timeout_seconds} SECONDS HIT")
-            exit_condition_met = True
-
-        # Sleep for a short duration between loops to not steal all system resources
-        # time.sleep(.05)
-
-    if not exe_exitted and not success_line_found:
-        logging.info(f"EXECUTABLE DID NOT EXIT, MANUALLY KILLING NOW")
-        exe.kill()
-        logging.info(f"PARSING REST OF LOG")
-        # Capture remaining output and check for the successful line
-        for exe_stdout_line in exe.stdout.readlines():
-            # Making an assumption that device output is adding a \n already
-            logging.info(exe_stdout_line.rstrip("\r\n"))
-            if args.success_line is not None and args.success_line in exe_stdout_line:
-                success_line_found = True
-                # Insert a blank line to make the log look better
-                print()
-                logging.info(f"{bashPass}SUCCESS_LINE_FOUND: {exe_stdout_line}{bashEnd}")
-
-    logging.info("END OF DEVICE OUTPUT")
-    logging.info("EXECUTABLE RUN SUMMARY:")
+    logger.info("END OF DEVICE OUTPUT")
+    logger.info("EXECUTABLE RUN SUMMARY:")
 
     exit_status = 1
+    # A failure line fails the run, whatever else happened
+    if failure_line_found:
+        logger.error(f"{bashFail}Failure Line: Output matched failure pattern: {matched_pattern[1]}{bashEnd}")
     # Check if a success line was found if that is an option
-    if ( args.success_line is not None) and (not success_line_found ):
-        logging.error(f"{bashFail}Success Line: Success line not output.{bashEnd}")
+    elif ( success_line_searched ) and ( matched_pattern is None ):
+        logger.error(f"{bashFail}Success Line: Success line not output.{bashEnd}")
         exit_status = 1
-    elif( args.success_line is not None) and ( success_line_found ):
+    elif( success_line_searched ) and ( matched_pattern is not None ):
         exit_status = 0
-        logging.info(f"Success Line: Success line was output")
+        logger.info(f"Success Line: Output matched success pattern: {matched_pattern[1]}")
 
     # Check if a exit code was found if that was an option
-    if ( ( exit_status != 0 ) and ( args.success_exit_code is not None) ):
+    if ( ( exit_status != 0 ) and ( args.success_exit_code is not None) and ( not failure_line_found ) ):
         # If the executable had to be force killed mark it as a failure
         if( not exe_exitted):
-            logging.error(f"{bashFail}Exit Code: Executable did not exit by itself.{bashEnd}\n")
+            logger.error(f"{bashFail}Exit Code: Executable did not exit by itself.{bashEnd}\n")
             exit_status = 1
         # If the executable exited with a different status mark it as a failure
         elif ( ( exe_exitted ) and ( exe_exit_status != args.success_exit_code ) ):
-            logging.error(f"{bashFail}Exit Code: {exe_exit_status} is not equal to requested exit code of {args.success_exit_code}{bashEnd}\n")
+            logger.error(f"{bashFail}Exit Code: {exe_exit_status} is not equal to requested exit code of {args.success_exit_code}{bashEnd}\n")
             exit_status = 1
         # If the executable exited with the same code as requested mark a success
         elif ( ( exe_exitted ) and ( exe_exit_status == args.success_exit_code ) ):
-            logging.info(f"{bashPass}Exit Code: Executable exited with requested exit code{bashEnd}")
+            logger.info(f"{bashPass}Exit Code: Executable exited with requested exit code{bashEnd}")
             exit_status = 0
 
-    logging.info(f"Runner thread exiting with status {exit_status}")
-    exit(exit_status)
+    if exit_status != 0:
+        sink.showTail()
+    logger.info(f"Runner exiting with status {exit_status}")
+    telemetry["status"] = exit_status
+    return exit_status, telemetry
+
+async def runWithRetries(args, logger):
+    """ Run the executable until it succeeds or runs out of retry attempts.
+        Returns the exit status of the last run and the telemetry of each run. """
+    logger.info(f"Running executable: {os.path.abspath(args.exe_path)} ")
+    logger.info(f"Timeout (seconds) per run: {args.timeout_seconds}")
+
+    if not args.retry_attempts:
+        args.retry_attempts = 0
+    else:
+        logger.info(f"Will relaunch the executable {args.retry_attempts} times to look for a valid success metric")
+
+    for kind, pattern in args.output_patterns.values():
+        logger.info(f"Searching for {kind} line: {pattern}")
+    if args.success_exit_code is not None:
+        logger.info(f"Searching for exit code: {args.success_exit_code}")
+
+    runs = []
+    for attempts in range(0,args.retry_attempts + 1):
+        # The monitor stops the executable itself once the timeout is hit
+        exit_status, telemetry = await runAndMonitor(args, logger)
+        runs.append(telemetry)
+        logger.info(f"RUN EXITED WITH STATUS {exit_status}")
+
+        if( ( attempts  < args.retry_attempts ) and exit_status != 0 ):
+            logger.warning(f"{bashWarn}DID NOT RECEIVE SUCCESSFUL EXIT STATUS, TRYING RE-ATTEMPT {attempts+1} OF {args.retry_attempts}{bashEnd}\n")
+        else:
+            break
+
+    return exit_status, runs
+
+def createTelemetryEntry(run_args, exit_status, runs):
+    """ Describe the runs of one executable for the telemetry report. """
+    return {
+        "name": getattr(run_args, "name", os.path.basename(os.path.abspath(run_args.exe_path))),
+        "exe_path": os.path.abspath(run_args.exe_path),
+        "status": exit_status,
+        "retries": len(runs) - 1,
+        "runs": runs,
+    }
+
+def writeTelemetry(telemetry_file, executables):
+    """ Write the telemetry of every executable to a JSON report. """
+    with open(telemetry_file, "w") as report:
+        json.dump({"executables": executables}, report, indent=2)
+    logging.info(f"Telemetry written to: {telemetry_file}")
+
+def checkRunOptions(args, logger):
+    """ Check that the executable can be run and has an exit condition, logging any problem. """
+    if args.success_exit_code is None and not args.success_line and not args.success_regex:
+        logger.error(f"{bashFail}Must specify at least one of the following: --success-line, --success-regex, --success-exit-code.{bashEnd}")
+        return False
+
+    elif args.success_exit_code is not None and ( args.success_line or args.success_regex ):
+        logger.warning(f"{bashWarn}Received an option for success-line and success-exit-code.{bashEnd}")
+        logger.warning(f"{bashWarn}Be aware: This program will report SUCCESS on either of these conditions being met{bashEnd}")
+
+    if args.timeout_seconds is None:
+        logger.error(f"{bashFail}Must specify a timeout with --timeout-seconds.{bashEnd}")
+        return False
+
+    if args.output_tail_lines and args.log_dir is None:
+        logger.error(f"{bashFail}Must specify --log-dir with --output-tail-lines, as only the tail of the output is shown.{bashEnd}")
+        return False
+
+    if not os.path.exists(args.exe_path):
+        logger.error(f"{bashFail}Input executable path \"{args.exe_path}\" does not exist.{bashEnd}")
+        return False
+
+    try:
+        compileOutputPatterns(args)
+    except re.error as error:
+        logger.error(f"{bashFail}Invalid regex \"{error.pattern}\": {error}{bashEnd}")
+        return False
+
+    return True
+
+def addLogFile(logger, log_dir, exe_name):
+    """ Store everything the logger outputs in a log file named after the executable. """
+    log_dir = os.path.abspath(log_dir)
+    # Create log directory if it does not exist.
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok = True)
+
+    # Add file handler to output logging to a log file
+    log_file_path = f'{log_dir}/{exe_name}_output.txt'
+    file_logging_handler = logging.FileHandler(log_file_path)
+    file_logging_handler.setLevel(logging.DEBUG)
+    file_logging_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    file_logging_handler.setFormatter(file_logging_formatter)
+    logger.addHandler(file_logging_handler)
+    logger.info(f"Storing logs in: {log_dir}")
+
+def loadManifest(args):
+    """ Read the executables to run from the manifest, using the command line options as defaults.
+        Returns None if the manifest is not valid. """
+    try:
+        with open(args.manifest) as manifest_file:
+            manifest = yaml.safe_load(manifest_file)
+    except (OSError, yaml.YAMLError) as error:
+        logging.error(f"{bashFail}Could not read manifest \"{args.manifest}\": {error}{bashEnd}")
+        return None
+
+    entries = manifest.get("executables") if isinstance(manifest, dict) else None
+    if not entries or not isinstance(entries, list):
+        logging.error(f"{bashFail}Manifest \"{args.manifest}\" must contain a list of executables.{bashEnd}")
+        return None
+
+    runs = []
+    for index, entry in enumerate(entries, start=1):
+        if not isinstance(entry, dict) or "exe-path" not in entry:
+            logging.error(f"{bashFail}Manifest entry {index} needs an exe-path: {entry}{bashEnd}")
+            return None
+        unknown_options = set(entry) - set(MANIFEST_OPTIONS)
+        if unknown_options:
+            logging.error(f"{bashFail}Manifest entry {index} has unknown options: {', '.join(sorted(unknown_options))}{bashEnd}")
+            return None
+        for option, value in entry.items():
+            expected_type = MANIFEST_OPTIONS[option]
+            if expected_type is list:
+                valid = isinstance(value, str) or ( isinstance(value, list) and all(isinstance(item, str) for item in value) )
+            else:
+                # YAML reads true and false as bools, which are also ints
+                valid = isinstance(value, expected_type) and not isinstance(value, bool)
+            if not valid:
+                logging.error(f"{bashFail}Manifest entry {index}: {option} must be {MANIFEST_TYPE_NAMES[expected_type]}, not {value!r}{bashEnd}")
+                return None
+
+        run_args = Namespace(name=os.path.basename(entry["exe-path"]),
+                             success_line=args.success_line,
+                             success_regex=args.success_regex,
+                             failure_line=args.failure_line,
+                             failure_regex=args.failure_regex,
+                             success_exit_code=args.success_exit_code,
+                             output_tail_lines=args.output_tail_lines,
+                             log_dir=args.log_dir,
+                             timeout_seconds=args.timeout_seconds,
+                             retry_attempts=args.retry_attempts)
+        for option, value in entry.items():
+            if option in PATTERN_OPTIONS and isinstance(value, str):
+                value = [value]
+            setattr(run_args, option.replace("-", "_"), value)
+        runs.append(run_args)
+
+    names = [run_args.name for run_args in runs]
+    duplicate_names = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicate_names:
+        logging.error(f"{bashFail}Executables in the manifest need unique names, set a name for: {', '.join(duplicate_names)}{bashEnd}")
+        return None
+
+    return runs
+
+def createRunLogger(run_args, log_dir):
+    """ Create a logger that prefixes the output of one executable of a batch with its name. """
+    logger = logging.getLogger(f"executable-monitor.{run_args.name}")
+    logger.propagate = False
+    run_logging_handler = logging.StreamHandler(sys.stdout)
+    run_logging_handler.setLevel(logging.DEBUG)
+    run_logging_handler.setFormatter(logging.Formatter(f'%(asctime)s - %(levelname)s - {run_args.name} - %(message)s'))
+    logger.addHandler(run_logging_handler)
+    if log_dir is not None:
+        addLogFile(logger, log_dir, run_args.name)
+    return logger
+
+async def runBatch(runs, loggers, workers):
+    """ Run the executables of a manifest, at most workers of them at a time.
+        Returns the exit status, telemetry of each run and duration of each executable. """
+    worker_slots = asyncio.Semaphore(workers)
+
+    async def runOne(run_args, logger):
+        async with worker_slots:
+            start_time = time.monotonic()
+            exit_status, runs = await runWithRetries(run_args, logger)
+            return exit_status, runs, time.monotonic() - start_time
+
+    return await asyncio.gather(*[runOne(run_args, logger) for run_args, logger in zip(runs, loggers)])
+
+def runManifest(args):
+    """ Run every executable of the manifest and log a summary, returning 0 if all of them succeeded. """
+    runs = loadManifest(args)
+    if runs is None:
+        return 1
+
+    loggers = [createRunLogger(run_args, args.log_dir) for run_args in runs]
+    if not all([checkRunOptions(run_args, logger) for run_args, logger in zip(runs, loggers)]):
+        return 1
+
+    workers = args.workers or os.cpu_count() or 1
+    logging.info(f"Running {len(runs)} executables, {workers} at a time")
+    results = asyncio.run(runBatch(runs, loggers, workers))
+
+    logging.info("BATCH RUN SUMMARY:")
+    passed = 0
+    for run_args, (exit_status, run_telemetry, duration) in zip(runs, results):
+        if exit_status == 0:
+            passed += 1
+            logging.info(f"{bashPass}PASSED - {run_args.name}: {len(run_telemetry)} run(s) in {duration:.1f} seconds{bashEnd}")
+        else:
+            logging.error(f"{bashFail}FAILED - {run_args.name}: {len(run_telemetry)} run(s) in {duration:.1f} seconds{bashEnd}")
+    logging.info(f"{passed} OF {len(runs)} EXECUTABLES PASSED")
+
+    if args.telemetry_file is not None:
+        writeTelemetry(args.telemetry_file, [createTelemetryEntry(run_args, exit_status, run_telemetry)
+                                             for run_args, (exit_status, run_telemetry, _) in zip(runs, results)])
+
+    return 0 if passed == len(runs) else 1
 
 if __name__ == '__main__':
     # Parse arguments
     parser = ArgumentParser(description='Executable monitor.')
-    parser.add_argument('--exe-path',
+    run_target = parser.add_mutually_exclusive_group(required=True)
+    run_target.add_argument('--exe-path',
                         type=str,
-                        required=True,
                         help='Path to the executable.')
+    run_target.add_argument('--manifest',
+                        type=str,
+                        help='Path to a YAML manifest of executables to run in parallel. Other options are used as defaults for each executable.')
     parser.add_argument('--log-dir',
                         type=str,
                         required=False,
                         help='Path to directory to store logs in.')
     parser.add_argument('--timeout-seconds',
                         type=int,
-                        required=True,
-                        help='Timeout for each executable run.')
+                        required=False,
+                        help='Timeout for each executable run. Required unless each executable of the manifest sets one.')
     parser.add_argument('--success-line',
                         type=str,
+                        action='append',
+                        required=False,
+                        help='Text of a line that indicates executable completed successfully (can be used multiple times). Required if --success-regex and --success-exit-code are not used.')
+    parser.add_argument('--success-regex',
+                        type=str,
+                        action='append',
+                        required=False,
+                        help='Regular expression found in a line that indicates executable completed successfully (can be used multiple times).')
+    parser.add_argument('--failure-line',
+                        type=str,
+                        action='append',
+                        required=False,
+                        help='Text of a line that indicates executable failed, stopping it immediately (can be used multiple times).')
+    parser.add_argument('--failure-regex',
+                        type=str,
+                        action='append',
                         required=False,
-                        help='Line that indicates executable completed successfully. Required if --success-exit-code is not used.')
+                        help='Regular expression found in a line that indicates executable failed, stopping it immediately (can be used multiple times).')
     parser.add_argument('--success-exit-code',
                         type=int,
                         required=False,
-                        help='Exit status that indicates that the executable completed successfully. Required if --success-line is not used.')
+                        help='Exit status that indicates that the executable completed successfully. Required if --success-line and --success-regex are not used.')
     parser.add_argument('--retry-attempts',
                         type=int,
                         required=False,
                         help='Number of times to attempt re-running the executable if the correct exit condition is not found.')
+    parser.add_argument('--output-tail-lines',
+                        type=int,
+                        required=False,
+                        help='Only write the output of the executable to the log file, and show this many of its last lines when a run fails. Requires --log-dir.')
+    parser.add_argument('--telemetry-file',
+                        type=str,
+                        required=False,
+                        help='Path to a JSON report of the timing, peak memory and CPU time of each run.')
+    parser.add_argument('--workers',
+                        type=int,
+                        required=False,
+                        help='Number of executables of the manifest to run at the same time. Defaults to the number of CPUs.')
 
     args = parser.parse_args()
 
-    if args.success_exit_code is None and args.success_line is None:
-        logging.error(f"{bashFail}Must specify at least one of the following: --success-line, --success-exit-code.{bashEnd}")
-        sys.exit(1)
-
-    elif args.success_exit_code is not None and args.success_line is not None:
-        logging.warning(f"{bashWarn}Received an option for success-line and success-exit-code.{bashEnd}")
-        logging.warning(f"{bashWarn}Be aware: This program will report SUCCESS on either of these conditions being met{bashEnd}")
+    if args.manifest is not None:
+        exit_status = runManifest(args)
+        logging.warning(f"{bashWarn}EXECUTABLE MONITOR EXITING WITH STATUS: {exit_status}{bashEnd}")
+        sys.exit(exit_status)
 
-    if not os.path.exists(args.exe_path):
-        logging.error(f"{bashFail}Input executable path \"{args.exe_path}\" does not exist.{bashEnd}")
+    if not checkRunOptions(args, logging.getLogger()):
         sys.exit(1)
 
-    # Convert any relative path (like './') in passed argument to absolute path.
-    exe_abs_path = os.path.abspath(args.exe_path)
-
     if args.log_dir is not None:
-        log_dir = os.path.abspath(args.log_dir)
-        # Create log directory if it does not exist.
-        if not os.path.exists(args.log_dir):
-            os.makedirs(args.log_dir, exist_ok = True)
-
-        # Add file handler to output logging to a log file
-        exe_name = os.path.basename(exe_abs_path)
-        log_file_path = f'{log_dir}/{exe_name}_output.txt'
-        file_logging_handler = logging.FileHandler(log_file_path)
-        file_logging_handler.setLevel(logging.DEBUG)
-        file_logging_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_logging_handler.setFormatter(file_logging_formatter)
-        logging.getLogger().addHandler(file_logging_handler)
-        logging.info(f"Storing logs in: {log_dir}")
-
-    logging.info(f"Running executable: {exe_abs_path} ")
-    logging.info(f"Timeout (seconds) per run: {args.timeout_seconds}")
-
-    if not args.retry_attempts:
-        args.retry_attempts = 0
-    else:
-        logging.info(f"Will relaunch the executable {args.retry_attempts} times to look for a valid success metric")
+        addLogFile(logging.getLogger(), args.log_dir, os.path.basename(os.path.abspath(args.exe_path)))
 
-    if args.success_line is not None:
-        logging.info(f"Searching for success line: {args.success_line}")
-    if args.success_exit_code is not None:
-        logging.info(f"Searching for exit code: {args.success_exit_code}")
+    exit_status, run_telemetry = asyncio.run(runWithRetries(args, logging.getLogger()))
 
-    # Small increase on the timeout to allow the thread to try and timeout
-    threadTimeout = ( args.timeout_seconds + 3 )
-    for attempts in range(0,args.retry_attempts + 1):
-        exit_status = 1
-        # Set the timeout for the thread
-        thread = Process(target=runAndMonitor, args=(args,))
-        thread.start()
-        # Wait for the thread to join, or hit a timeout.
-        thread.join(timeout=threadTimeout)
-        # As join() always returns None, you must call is_alive() after join() to decide whether a timeout happened
-        # If the thread is still alive, the join() call timed out.
-        if ( ( thread.exitcode is None ) and ( thread.is_alive() ) ):
-            # Print the thread timeout they passed in to the log
-            logging.warning(f"{bashWarn}EXECUTABLE HAS HIT TIMEOUT OF {threadTimeout - 3} SECONDS: FORCE KILLING THREAD{bashEnd}")
-            thread.kill()
-            exit_status = 1
-        else:
-            exit_status = thread.exitcode
-            logging.info(f"THREAD EXITED WITH EXITCODE {exit_status}")
-
-        if( ( attempts  < args.retry_attempts ) and exit_status != 0 ):
-            logging.warning(f"{bashWarn}DID NOT RECEIVE SUCCESSFUL EXIT STATUS, TRYING RE-ATTEMPT {attempts+1} OF {args.retry_attempts}{bashEnd}\n")
-        else:
-            break
+    if args.telemetry_file is not None:
+        writeTelemetry(args.telemetry_file, [createTelemetryEntry(args, exit_status, run_telemetry)])
 
     logging.warning(f"{bashWarn}EXECUTABLE MONITOR EXITING WITH STATUS: {exit_status}{bashEnd}")
     # Report Final Exit Status
@@ -13,6 +13,13 @@ from bs4 import BeautifulSoup
 from termcolor import cprint
 from multiprocessing import Pool
 import traceback
+import json
+import html
+import email.utils
+import xml.etree.ElementTree as ET
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 
 THIS_FILE_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -22,33 +29,94 @@ MARKDOWN_SEARCH_TERM = r"\.md$"
 # Regex to find a URL
 URL_SEARCH_TERM = r'(\b(https?)://[^\s\)\]\\"<>]+[^\s\)\.\]\\"<>])'
 HTTP_URL_SEARCH_TERM = r'https?://'
+# Regexes used to find links and ids in Markdown files without converting them to HTML.
+MD_FENCE_SEARCH = re.compile(r'^[ \t]*(`{3,}|~{3,})')
+MD_ATX_HEADING_SEARCH = re.compile(r'^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$')
+MD_SETEXT_UNDERLINE_SEARCH = re.compile(r'^ {0,3}(=+|-+)[ \t]*$')
+MD_THEMATIC_BREAK_SEARCH = re.compile(r'^ {0,3}(?:(?:\*[ \t]*){3,}|(?:-[ \t]*){3,}|(?:_[ \t]*){3,})$')
+MD_LIST_ITEM_SEARCH = re.compile(r'^ {0,3}(?:[-+*]|\d{1,9}[.)])(?:[ \t]|$)')
+MD_BLOCKQUOTE_SEARCH = re.compile(r'^ {0,3}> ?')
+MD_LINK_DEFINITION_SEARCH = re.compile(r'^ {0,3}\[((?:[^\]\\]|\\.)+)\]:[ \t]*(<[^>\n]*>|\S+)(?:[ \t]+(?:"[^"]*"|\'[^\']*\'|\([^)]*\)))?[ \t]*$')
+MD_LINK_LABEL_SEARCH = re.compile(r'^ {0,3}\[((?:[^\]\\]|\\.)+)\]:[ \t]*$')
+MD_LINK_DESTINATION_SEARCH = re.compile(r'^[ \t]*(<[^>\n]*>|\S+)(?:[ \t]+(?:"[^"]*"|\'[^\']*\'|\([^)]*\)))?[ \t]*$')
+MD_FRONT_MATTER_END_SEARCH = re.compile(r'^(?:---|\.\.\.)[ \t]*$')
+MD_UNDERSCORE_EMPHASIS_SEARCH = re.compile(r'(?<![A-Za-z0-9_])(_{1,3})(?=\S)(.+?)(?<=\S)\1(?![A-Za-z0-9_])')
+MD_ESCAPE_SEARCH = re.compile(r'\\([!-/:-@\[-`{-~])')
+MD_CODE_SPAN_SEARCH = re.compile(r'(`+)(.+?)(?<!`)\1(?!`)', re.DOTALL)
+MD_COMMENT_SEARCH = re.compile(r'<!--.*?-->', re.DOTALL)
+MD_AUTOLINK_SEARCH = re.compile(r'<([A-Za-z][A-Za-z0-9+.-]{1,31}:[^\s<>]*)>')
+MD_BARE_URL_SEARCH = re.compile(r'(?<![\w/])(?:https?://|www\.)[^\s<]+', re.IGNORECASE)
+MD_HEADING_LINK_SEARCH = re.compile(r'!?\[([^\[\]]*)\](?:\([^()]*\)|\[[^\[\]]*\])?')
+HTML_TAG_SEARCH = re.compile(r'<([A-Za-z][A-Za-z0-9-]*)((?:\s[^<>]*)?)/?>')
+HTML_ATTRIBUTE_SEARCH = re.compile(r'([A-Za-z_:][\w:.-]*)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'=<>`]+))')
+# Files are searched for URLs in chunks of this many characters, so memory use doesn't
+# depend on the size of the file.
+URL_SCAN_CHUNK_SIZE = 1024 * 1024
+# A run of characters without whitespace is held back until the next chunk in case it is a
+# URL that spans the chunk boundary, but only up to this length.
+URL_SCAN_MAX_CARRY = 64 * 1024
 # Some HTML tags that we choose to ignore
 IGNORED_LINK_SCHEMES = r'mailto:|ftps?:|tel:|file:'
 # Regexes to identify links to Github PRs or issues, which are very common in changelogs
 # and may result in rate limiting if each link is fetched manually.
 PULL_REQUEST_SEARCH = r'https://github.com/([A-Za-z0-9_.-]+)/([A-Za-z0-9_.-]+)/pull/(\d+)$'
 ISSUE_SEARCH = r'https://github.com/([A-Za-z0-9_.-]+)/([A-Za-z0-9_.-]+)/issues/(\d+)$'
-# The value at which we should fetch all of a repo's PRs or issues rather than testing
-# individually. It takes roughly half a second to test one link, and between 1/2 to 5
-# seconds to fetch them all, depending on the size of the repo.
-GITHUB_FETCH_THRESHOLD = 5
+# Number of PRs or issues resolved per bulk query. Each one is an aliased field of a
+# single GraphQL request, so a changelog with hundreds of links costs only a few requests.
+GITHUB_BATCH_SIZE = 100
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+# Time, in seconds, that a link check or a GitHub query may wait for the server, so a
+# stalled connection can't hang the run.
+HTTP_TIMEOUT_SECONDS = 30
+# Default limits on the number of links tested at the same time, in total and per host.
+# The per-host limit keeps us polite towards any single server, while the global limit
+# lets the run time scale with the number of distinct hosts rather than number of links.
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MAX_PER_HOST = 4
+# Default number of connections kept open per host by the pooled HTTP sessions.
+DEFAULT_POOL_SIZE = DEFAULT_MAX_PER_HOST
+# Default time, in seconds, for which good and broken results in the persistent link
+# cache are trusted before the link is tested again. Broken links are always retested
+# by default so that a fixed link doesn't keep failing the run.
+DEFAULT_CACHE_TTL_GOOD = 24 * 60 * 60
+DEFAULT_CACHE_TTL_BAD = 0
+# Entries that haven't been refreshed for this long are dropped from the cache file.
+CACHE_RETENTION_SECONDS = 30 * 24 * 60 * 60
+# Rate limiting. A host is not limited until it answers with 429. It then gets a token
+# bucket that starts at THROTTLED_RATE requests per second, is halved on every further
+# 429, and grows by RATE_INCREASE for every request that isn't limited.
+THROTTLED_RATE = 1.0
+MIN_RATE = 1 / 60
+MAX_RATE = 50.0
+RATE_INCREASE = 0.1
+# Wait used when a 429 response has no Retry-After header, and the longest wait honored.
+DEFAULT_RETRY_AFTER = 60
+MAX_RETRY_AFTER = 300
+# Number of times a link is tried before a 429 is reported as its result.
+RATE_LIMIT_TRIES = 3
+# Ports that are dropped from links, and query parameters that only track where a visitor
+# came from. Links that only differ in these are tested once.
+DEFAULT_PORTS = { 'http': 80, 'https': 443 }
+TRACKING_QUERY_PARAMETERS = r'^(utm_\w+|fbclid|gclid|dclid|msclkid|mc_cid|mc_eid|_ga)$'
+# Upper bounds, in seconds, of the buckets of the per-host latency histograms in the report.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Number of revisions kept in the link manifest, and how far back in the history of the
+# base revision to look for one of them.
+MANIFEST_MAX_REVISIONS = 10
+MANIFEST_SEARCH_DEPTH = 100
 
-NUM_PR_KEY = 'num_prs'
-NUM_IS_KEY = 'num_issues'
+LINKED_PR_KEY = 'linked_prs'
+LINKED_IS_KEY = 'linked_issues'
 PR_KEY = 'prs'
 ISSUE_KEY = 'issues'
-PR_CACHED_KEY = 'pr_cached'
-ISSUE_CACHED_KEY = 'issue_cached'
 """
 Format for repository list:
 {
     "owner/repository": {
-        "num_prs": 0,           //Number of links that point to an issue in this repo.
-        "num_issues": 0,        //Number of links that point to a PR in this repo.
-        "pr_cached": True,      //Whether we've already fetched and cached PRs/issues.
-        "issue_cached": True,
-        "prs": (1,2,3),         //Cached set of PRs.
-        "issues": (4,5,6)       //Cached set of issues.
+        "linked_prs": {1,2,3},      //Numbers of the PRs that links point to.
+        "linked_issues": {4,5,6},   //Numbers of the issues that links point to.
+        "prs": {1,2},               //PRs that were found to exist.
+        "issues": {4,5}             //Issues that were found to exist.
     }
 }
 """
@@ -57,58 +125,116 @@ main_repo_list = {}
 use_gh_cache = True
 # Track links so that we don't test multiple times.
 link_cache = {}
+"""
+Format for the persistent link cache, stored one JSON object per line in the cache file:
+{
+    "url": "https://www.freertos.org",  //Link that was tested.
+    "broken": False,                    //Result of the test.
+    "status": 200,                      //Status reported for the link.
+    "checked": 1700000000.0,            //Time at which the link was last tested.
+    "etag": "...",                      //ETag and Last-Modified validators, if the
+    "last_modified": "..."              //server sent any.
+}
+"""
+persistent_cache = {}
+"""
+Format for the link manifest, written by full runs:
+{
+    "<commit>": ["https://www.freertos.org", ...]   //Good links found at that commit.
+}
+"""
+link_manifest = {}
+# Time, in seconds, for which persistent cache entries are trusted. Indexed by whether
+# the cached result is broken.
+cache_ttl = { False: DEFAULT_CACHE_TTL_GOOD, True: DEFAULT_CACHE_TTL_BAD }
 # HTTP headers to user when making a request
 http_headers = requests.utils.default_headers()
+# Header set sent by curl. Some servers treat this differently to a browser-like request.
+MINIMAL_HTTP_HEADERS = { 'User-Agent': 'curl/8.5.0', 'Accept': '*/*' }
+FALLBACK_ATTEMPTS_KEY = 'attempts'
+FALLBACK_GOOD_KEY = 'good'
+FALLBACK_SECONDS_KEY = 'seconds'
+# Per-stage counters of the fallback chain, used to see which stages find links and what they cost.
+fallback_stats = defaultdict(lambda: { FALLBACK_ATTEMPTS_KEY: 0, FALLBACK_GOOD_KEY: 0, FALLBACK_SECONDS_KEY: 0.0 })
+fallback_stats_lock = threading.Lock()
+# Requests sent for each link, with the stage, status and time of each one.
+link_attempts = defaultdict(list)
+# Where the result of each link came from: a stage of the fallback chain, or a cache.
+link_stage = {}
+# Time spent in each phase of the run, for the report.
+phase_times = {}
+# Results of relative links and anchors, as (file, link, status) tuples.
+local_link_results = []
+# Pooled HTTP sessions, one per host and certificate bundle, so that requests to the same
+# server reuse open connections instead of paying for a new TCP and TLS handshake.
+http_sessions = {}
+http_sessions_lock = threading.Lock()
+# Number of connections each session keeps open.
+http_pool_size = DEFAULT_POOL_SIZE
+
+# Snapshot of the repository tree, taken once per run by snapshot_tree().
+# tree_dirs holds the directories whose contents were listed, and tree_entries every
+# file and directory found in them.
+tree_dirs = set()
+tree_entries = set()
+# Results of os.path.exists for paths that the snapshot doesn't cover.
+path_exists_cache = {}
+# Normalized ids of each parsed Markdown file, by absolute path, for cross-file anchors.
+file_anchors = {}
+
+def normalize_anchor(anchor):
+    """Normalize an id or the fragment of a link so that the two can be compared"""
+    return urllib.parse.unquote(anchor).lower()
 
 class HtmlFile:
     """A class of files with a .html extension"""
 
+    # Pool workers pickle these objects back to the main process, so keep them small.
+    __slots__ = ('name', 'abspath', 'ids', 'internal_links', 'external_links', 'broken_links', 'linked_repos')
+
     def __init__(self, html_file_name):
         """Parse html in file and extract links and ids"""
 
-        self.ids = []
-        self.internal_links = []
-        self.external_links = []
-        self.name = html_file_name
-        self.abspath = os.path.abspath(html_file_name)
-        self.broken_links = []
-        self.linked_repos = {}
+        self.init_links(html_file_name)
         with open(html_file_name, 'r') as infile:
             html_data = infile.read()
-        dirname = os.path.dirname(self.name)
         soup = BeautifulSoup(html_data, 'html.parser')
         # Find IDs. This is to check internal links within a file.
         for tag in soup.find_all(True, {'id': True}):
-            self.ids.append(tag.get('id'))
-        pr_search = re.compile(PULL_REQUEST_SEARCH)
-        issue_search = re.compile(ISSUE_SEARCH)
+            self.add_id(tag.get('id'))
         for tag in soup.find_all('a'):
-            link = tag.get('href')
-            if not re.search(HTTP_URL_SEARCH_TERM, link, re.IGNORECASE):
-                if not re.search(IGNORED_LINK_SCHEMES, link, re.IGNORECASE):
-                    if link is not None and link not in self.internal_links:
-                        self.internal_links.append(link)
-            else:
-                if link is not None and link not in self.external_links:
-                    self.external_links.append(link)
-                    pr_match = pr_search.search(link)
-                    if pr_match:
-                        self.increment_gh_link_count(pr_match.group(1), pr_match.group(2), pr_match.group(3), True)
-                    else:
-                        issue_match = issue_search.search(link)
-                        if issue_match:
-                            self.increment_gh_link_count(issue_match.group(1), issue_match.group(2), issue_match.group(3), False)
-
-    def increment_gh_link_count(self, owner, repo, num, is_pr):
-        """Increment the count of links to Github PRs or issues"""
-
-        repo_key = f'{owner}/{repo}'.lower()
-        if repo_key not in self.linked_repos:
-            self.linked_repos[repo_key] = { NUM_IS_KEY : 0, NUM_PR_KEY : 0 }
-        if is_pr:
-            self.linked_repos[repo_key][NUM_PR_KEY] += 1
-        else:
-            self.linked_repos[repo_key][NUM_IS_KEY] += 1
+            self.add_link(tag.get('href'))
+
+    def init_links(self, file_name):
+        """Initialize the links and ids of a file"""
+
+        # Normalized ids, for anchor lookups.
+        self.ids = set()
+        # Links are kept as the keys of dicts, which dedups them but keeps document order.
+        self.internal_links = {}
+        self.external_links = {}
+        self.name = file_name
+        self.abspath = os.path.abspath(file_name)
+        self.broken_links = []
+        self.linked_repos = {}
+
+    def add_id(self, id):
+        """Record an id that links to the file may point at"""
+        self.ids.add(normalize_anchor(id))
+
+    def add_link(self, link):
+        """Record a link as an internal or external link of the file"""
+
+        # Anchors may have no href, e.g. <a name="...">.
+        if link is None:
+            return
+        if not re.search(HTTP_URL_SEARCH_TERM, link, re.IGNORECASE):
+            if not re.search(IGNORED_LINK_SCHEMES, link, re.IGNORECASE):
+                self.internal_links[link] = None
+        elif link not in self.external_links:
+            # Links are canonicalized once, here, and tested under that key.
+            self.external_links[link] = canonical_url(link)
+            add_gh_link(self.linked_repos, self.external_links[link])
 
     def print_filename(self, filename, file_printed):
         """Prints a file name if it hasn't been printed before"""
@@ -132,34 +258,41 @@ class HtmlFile:
                 id = link_elements[1]
             if path == '':
                 if id is not None:
-                    if id.lower() not in self.ids:
+                    if normalize_anchor(id) not in self.ids:
                         self.broken_links.append(link)
+                        local_link_results.append((files[self.name], link, 'Unknown link'))
                         file_printed = self.print_filename(files[self.name], file_printed)
                         cprint(f'\tUnknown link: {link}', 'red')
-                    elif verbose:
-                        file_printed = self.print_filename(files[self.name], file_printed)
-                        cprint(f'\t{link}', 'green')
+                    else:
+                        local_link_results.append((files[self.name], link, 'Good'))
+                        if verbose:
+                            file_printed = self.print_filename(files[self.name], file_printed)
+                            cprint(f'\t{link}', 'green')
                 continue
 
             # At this point, this is probably a link to a file in the same repo,
             # so we test if the file exists.
             filename = os.path.join(dirname, path)
             absfile = os.path.abspath(filename)
-            # Note: We don't test whether the link target exists, just the file.
-            if not os.path.exists(absfile):
+            if not path_exists(absfile):
                 self.broken_links.append(link)
+                local_link_results.append((files[self.name], link, 'Unknown file'))
                 file_printed = self.print_filename(files[self.name], file_printed)
                 cprint(f'\tUnknown file: {path}', 'red')
-            elif verbose:
+            # Anchors can only be tested in the Markdown files that were parsed.
+            elif id and absfile in file_anchors and normalize_anchor(id) not in file_anchors[absfile]:
+                self.broken_links.append(link)
+                local_link_results.append((files[self.name], link, 'Unknown link'))
                 file_printed = self.print_filename(files[self.name], file_printed)
-                cprint(f'\t{link}','green')
-
-        for link in self.external_links:
-            # Remove the trailing slash or trailing coma
-            if(link[-1] == "/" or link[-1] == ","):
-                is_broken, status_code = test_url(link[:-1])
+                cprint(f'\tUnknown link: {link}', 'red')
             else:
-                is_broken, status_code = test_url(link)
+                local_link_results.append((files[self.name], link, 'Good'))
+                if verbose:
+                    file_printed = self.print_filename(files[self.name], file_printed)
+                    cprint(f'\t{link}','green')
+
+        for link, key in self.external_links.items():
+            is_broken, status_code = test_url(key)
             if is_broken:
                 self.broken_links.append(link)
                 file_printed = self.print_filename(files[self.name], file_printed)
@@ -169,10 +302,365 @@ class HtmlFile:
                     file_printed = self.print_filename(files[self.name], file_printed)
                     cprint(f'  {status_code}\t{link}', 'green')
 
+class MarkdownFile(HtmlFile):
+    """A class of files with a .md extension. The links and ids that pandoc would write to
+    HTML are extracted from the Markdown directly, without running pandoc."""
+
+    __slots__ = ()
+
+    def __init__(self, markdown_file_name):
+        """Parse Markdown in file and extract links and ids"""
+
+        self.init_links(markdown_file_name)
+        with open(markdown_file_name, 'r', encoding='utf-8', errors='ignore') as infile:
+            markdown_data = infile.read()
+        # Comments are passed through to the HTML, so links in them are never found.
+        markdown_data = MD_COMMENT_SEARCH.sub(lambda m: '\n' * m.group(0).count('\n'), markdown_data)
+        headings, blocks, definitions = split_markdown_blocks(markdown_data.splitlines())
+        used_ids = set()
+        html_ids = set()
+        for heading in headings:
+            self.add_id(unique_heading_id(heading, used_ids))
+        for block in blocks:
+            for link in markdown_block_links(block, definitions, html_ids):
+                self.add_link(link)
+        for id in html_ids:
+            self.add_id(id)
+
+def normalize_link_label(label):
+    """Normalize a Markdown link label for matching references to definitions"""
+    return ' '.join(label.split()).lower()
+
+def split_markdown_blocks(lines):
+    """Split Markdown into heading texts, blocks of inline text, and link reference definitions"""
+
+    headings = []
+    blocks = []
+    definitions = {}
+    paragraph = []
+    # Whether the current paragraph can become a setext heading.
+    setext_allowed = False
+    fence = None
+    fence_indent = 0
+    previous_blank = True
+    in_list = False
+
+    pending_label = None
+
+    # YAML front matter isn't part of the document.
+    if len(lines) > 0 and lines[0].rstrip() == '---':
+        for i in range(1, len(lines)):
+            if MD_FRONT_MATTER_END_SEARCH.match(lines[i]):
+                lines = [''] * (i + 1) + lines[i + 1:]
+                break
+
+    for line in lines:
+        # The destination of a link reference definition may be on the next line.
+        if pending_label is not None:
+            label = pending_label
+            pending_label = None
+            destination_match = MD_LINK_DESTINATION_SEARCH.match(line)
+            if destination_match:
+                if label not in definitions:
+                    definitions[label] = markdown_destination(destination_match.group(1))
+                continue
+            paragraph.append(pending_line)
+            setext_allowed = not in_list
+        if fence is not None:
+            fence_match = MD_FENCE_SEARCH.match(line)
+            if fence_match and fence_match.group(1)[0] == fence[0] and len(fence_match.group(1)) >= len(fence) \
+                    and line.strip() == fence_match.group(1):
+                fence = None
+                continue
+            # A code block in a list item also ends with the item.
+            if fence_indent == 0 or line.strip() == '' or len(line) - len(line.lstrip()) >= fence_indent:
+                continue
+            fence = None
+        # Blocks in quotes are parsed like any other block.
+        while MD_BLOCKQUOTE_SEARCH.match(line):
+            line = MD_BLOCKQUOTE_SEARCH.sub('', line, count=1)
+        fence_match = MD_FENCE_SEARCH.match(line)
+        # The info string of a backtick fence can't contain backticks, else it's a code span.
+        if fence_match and not (fence_match.group(1)[0] == '`' and '`' in line[fence_match.end():]):
+            blocks.append('\n'.join(paragraph))
+            paragraph = []
+            fence = fence_match.group(1)
+            fence_indent = len(line) - len(line.lstrip()) if in_list else 0
+            continue
+        if line.strip() == '':
+            blocks.append('\n'.join(paragraph))
+            paragraph = []
+            previous_blank = True
+            continue
+        # An indented code block, which can't interrupt a paragraph or appear in a list.
+        if previous_blank and not in_list and len(paragraph) == 0 and (line.startswith('    ') or line.startswith('\t')):
+            continue
+        heading_match = MD_ATX_HEADING_SEARCH.match(line)
+        if heading_match:
+            blocks.append('\n'.join(paragraph))
+            paragraph = []
+            headings.append(heading_match.group(2) or '')
+            blocks.append(heading_match.group(2) or '')
+            previous_blank = False
+            continue
+        if len(paragraph) > 0 and setext_allowed and MD_SETEXT_UNDERLINE_SEARCH.match(line):
+            heading = '\n'.join(paragraph)
+            paragraph = []
+            headings.append(heading)
+            blocks.append(heading)
+            continue
+        if MD_THEMATIC_BREAK_SEARCH.match(line):
+            blocks.append('\n'.join(paragraph))
+            paragraph = []
+            continue
+        definition_match = MD_LINK_DEFINITION_SEARCH.match(line)
+        if definition_match and len(paragraph) == 0:
+            label = normalize_link_label(definition_match.group(1))
+            # The first definition of a label takes precedence.
+            if label not in definitions:
+                definitions[label] = markdown_destination(definition_match.group(2))
+            previous_blank = False
+            continue
+        label_match = MD_LINK_LABEL_SEARCH.match(line)
+        if label_match and len(paragraph) == 0:
+            pending_label = normalize_link_label(label_match.group(1))
+            pending_line = line
+            previous_blank = False
+            continue
+        if MD_LIST_ITEM_SEARCH.match(line):
+            blocks.append('\n'.join(paragraph))
+            paragraph = []
+            in_list = True
+        elif previous_blank and not line[0].isspace():
+            in_list = False
+        if len(paragraph) == 0:
+            setext_allowed = not in_list and not line.lstrip().startswith('|')
+        paragraph.append(line)
+        previous_blank = False
+    if pending_label is not None:
+        paragraph.append(pending_line)
+    blocks.append('\n'.join(paragraph))
+
+    return headings, [block for block in blocks if block != ''], definitions
+
+def markdown_destination(destination):
+    """Convert a Markdown link destination to the href pandoc writes for it"""
+
+    if destination.startswith('<') and destination.endswith('>'):
+        destination = destination[1:-1]
+    destination = MD_ESCAPE_SEARCH.sub(r'\1', destination)
+    return html.unescape(destination)
+
+def parse_inline_destination(text, pos):
+    """Parse the destination and optional title of an inline link starting after its '('.
+    Returns the destination and the position after the closing ')', or None."""
+
+    length = len(text)
+    while pos < length and text[pos].isspace():
+        pos += 1
+    if pos < length and text[pos] == '<':
+        end = text.find('>', pos)
+        if end == -1 or '\n' in text[pos:end]:
+            return None
+        destination = text[pos:end + 1]
+        pos = end + 1
+    else:
+        start = pos
+        depth = 0
+        while pos < length and not text[pos].isspace():
+            if text[pos] == '\\':
+                pos += 2
+                continue
+            if text[pos] == '(':
+                depth += 1
+            elif text[pos] == ')':
+                if depth == 0:
+                    break
+                depth -= 1
+            pos += 1
+        destination = text[start:pos]
+    while pos < length and text[pos].isspace():
+        pos += 1
+    # Skip the title.
+    if pos < length and text[pos] in '"\'(':
+        close = ')' if text[pos] == '(' else text[pos]
+        end = text.find(close, pos + 1)
+        if end == -1:
+            return None
+        pos = end + 1
+        while pos < length and text[pos].isspace():
+            pos += 1
+    if pos >= length or text[pos] != ')':
+        return None
+    return destination, pos + 1
+
+def trim_bare_url(url):
+    """Trim the trailing punctuation that GitHub-flavored Markdown excludes from bare URLs"""
+
+    while True:
+        trimmed = url.rstrip('?!.,:*_~\'"')
+        if trimmed.endswith(')') and trimmed.count(')') > trimmed.count('('):
+            trimmed = trimmed[:-1]
+        if trimmed.endswith(']') and trimmed.count(']') > trimmed.count('['):
+            trimmed = trimmed[:-1]
+        trimmed = re.sub(r'&[A-Za-z0-9]+;$', '', trimmed)
+        if trimmed == url:
+            return url
+        url = trimmed
+
+def mask(text, start, end):
+    """Blank out part of a text so that it isn't searched again"""
+    return text[:start] + ' ' * (end - start) + text[end:]
+
+def markdown_block_links(text, definitions, ids):
+    """Returns the hrefs pandoc would write for the links in a block of inline Markdown, in
+    document order. The ids of any raw HTML tags are added to ids."""
+
+    links = []
+    # Link labels are matched against the source, as they may contain code spans.
+    source = text
+    # Nothing in a code span is a link.
+    text = MD_CODE_SPAN_SEARCH.sub(lambda m: ' ' * len(m.group(0)), text)
+
+    # Raw HTML is passed through as is.
+    for tag_match in HTML_TAG_SEARCH.finditer(text):
+        for attribute_match in HTML_ATTRIBUTE_SEARCH.finditer(tag_match.group(2)):
+            name = attribute_match.group(1).lower()
+            value = html.unescape(next(v for v in attribute_match.groups()[1:] if v is not None))
+            if name == 'id':
+                ids.add(value)
+            elif name == 'href' and tag_match.group(1).lower() == 'a':
+                links.append((tag_match.start(), value))
+        text = mask(text, tag_match.start(), tag_match.end())
+
+    for autolink_match in MD_AUTOLINK_SEARCH.finditer(text):
+        links.append((autolink_match.start(), markdown_destination(autolink_match.group(1))))
+        text = mask(text, autolink_match.start(), autolink_match.end())
+
+    # Inline and reference links, matching brackets the way Markdown does.
+    openers = []
+    pos = 0
+    while pos < len(text):
+        c = text[pos]
+        if c == '\\':
+            pos += 2
+            continue
+        if c == '[':
+            openers.append((pos, pos > 0 and text[pos - 1] == '!'))
+        elif c == ']' and len(openers) > 0:
+            start, is_image = openers.pop()
+            end = None
+            destination = None
+            if text.startswith('(', pos + 1):
+                inline = parse_inline_destination(text, pos + 2)
+                if inline is not None:
+                    destination = markdown_destination(inline[0])
+                    end = inline[1]
+            if end is None and text.startswith('[', pos + 1):
+                close = text.find(']', pos + 2)
+                if close != -1:
+                    label = normalize_link_label(source[pos + 2:close] or source[start + 1:pos])
+                    if label in definitions:
+                        destination = definitions[label]
+                        end = close + 1
+            elif end is None:
+                label = normalize_link_label(source[start + 1:pos])
+                if label in definitions:
+                    destination = definitions[label]
+                    end = pos + 1
+            if end is not None:
+                # Images aren't links, and links can't contain other links.
+                if not is_image:
+                    links.append((start, destination))
+                    openers = [opener for opener in openers if opener[1]]
+                text = mask(text, start, end)
+                pos = end
+                continue
+        pos += 1
+
+    # Bare URLs are links in GitHub-flavored Markdown.
+    for url_match in MD_BARE_URL_SEARCH.finditer(text):
+        url = trim_bare_url(url_match.group(0))
+        if url.lower().startswith('www.'):
+            url = 'http://' + url
+        links.append((url_match.start(), markdown_destination(url)))
+
+    return [link for _, link in sorted(links, key=lambda link: link[0])]
+
+def heading_text(text):
+    """Convert the inline Markdown of a heading to the plain text pandoc makes its id from"""
+
+    # Runs of whitespace in the source are a single space, even around removed elements.
+    text = ' '.join(text.split())
+    # Only letters, numbers, spaces, '_' and '-' of a code span end up in the id. Keep its
+    # underscores out of the way of the emphasis markers removed below.
+    text = MD_CODE_SPAN_SEARCH.sub(
+        lambda m: ''.join(c for c in m.group(2).strip() if c.isalnum() or c in '_- ').replace('_', '\uE000'),
+        text)
+    text = HTML_TAG_SEARCH.sub('', text)
+    text = re.sub(r'</[A-Za-z][A-Za-z0-9-]*\s*>', '', text)
+    # Keep only the text of images and links, starting with the innermost one.
+    previous = None
+    while previous != text:
+        previous = text
+        text = MD_HEADING_LINK_SEARCH.sub(r'\1', text, count=1)
+    # Escaped underscores are never emphasis.
+    text = MD_ESCAPE_SEARCH.sub(lambda m: m.group(1).replace('_', '\uE000'), text)
+    # Remove the markers of emphasis. Underscores inside words are not emphasis.
+    previous = None
+    while previous != text:
+        previous = text
+        text = MD_UNDERSCORE_EMPHASIS_SEARCH.sub(r'\2', text)
+    return html.unescape(text).replace('\uE000', '_')
+
+def unique_heading_id(text, used_ids):
+    """Returns the id pandoc gives a heading with GitHub-flavored auto identifiers"""
+
+    base_id = ''.join('-' if c.isspace() else c for c in heading_text(text).lower() if c.isalnum() or c.isspace() or c in '_-')
+    if base_id == '':
+        base_id = 'section'
+    heading_id = base_id
+    number = 1
+    while heading_id in used_ids:
+        heading_id = f'{base_id}-{number}'
+        number += 1
+    used_ids.add(heading_id)
+    return heading_id
+
 def parse_file(html_file):
     """Parse href tags from an HTML file"""
     return HtmlFile(html_file)
 
+def parse_markdown_file(markdown_file):
+    """Parse links from a Markdown file"""
+    return MarkdownFile(markdown_file)
+
+def snapshot_tree(root, exclude_dirs):
+    """Walk the tree once, recording every file and directory in it. Returns the files found."""
+
+    file_list = []
+    for dirpath, dirs, files in os.walk(root):
+        abs_dirpath = os.path.abspath(dirpath)
+        tree_dirs.add(abs_dirpath)
+        tree_entries.update(os.path.join(abs_dirpath, name) for name in dirs + files)
+        # Prune dirs to remove exclude directories from search.
+        dirs[:] = [dir for dir in dirs if dir.lower() not in exclude_dirs]
+        file_list += [os.path.join(dirpath, f) for f in files]
+    return file_list
+
+def path_exists(path):
+    """Check whether an absolute path exists, using the tree snapshot where possible"""
+
+    if path in tree_entries or path in tree_dirs:
+        return True
+    # The snapshot lists everything in a walked directory, so a miss there is final.
+    if os.path.dirname(path) in tree_dirs:
+        return False
+    # Excluded directories, symbolic links to directories and paths outside the tree.
+    if path not in path_exists_cache:
+        path_exists_cache[path] = os.path.exists(path)
+    return path_exists_cache[path]
+
 def html_name_from_markdown(filename):
     md_pattern = re.compile(r"\.md$", re.IGNORECASE)
     return md_pattern.sub('.html', filename)
@@ -193,94 +681,295 @@ def create_html(markdown_file):
     )
     return process
 
+class RateLimited(Exception):
+    """Raised when a host answers with 429, so that the link is tested again later"""
+
+class HostRateLimiter:
+    """Per-host token buckets that learn from 429 responses and rate limit headers.
+    A host that is rate limited is parked without holding up requests to other hosts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Requests per second allowed for each host. Hosts that aren't listed are not limited.
+        self.rates = {}
+        self.tokens = {}
+        self.updated = {}
+        # Time until which no requests are sent to a host.
+        self.parked_until = {}
+        # Total time that requests to each host were held back for.
+        self.waited = defaultdict(float)
+        self.wait_end = {}
+
+    def reserve(self, host):
+        """Takes a token for a request to host. Returns the number of seconds to wait first."""
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.parked_until.get(host, 0.0) - now)
+            rate = self.rates.get(host)
+            if rate is not None:
+                # Refill the bucket, holding at most one second's worth of tokens.
+                elapsed = now - self.updated.get(host, now)
+                self.tokens[host] = min(max(1.0, rate), self.tokens.get(host, 1.0) + elapsed * rate) - 1
+                self.updated[host] = now
+                if self.tokens[host] < 0:
+                    wait = max(wait, -self.tokens[host] / rate)
+            # Waits of concurrent requests overlap, so only count the time that extends
+            # past the waits already counted.
+            end = now + wait
+            self.waited[host] += max(0.0, end - max(now, self.wait_end.get(host, 0.0)))
+            self.wait_end[host] = max(end, self.wait_end.get(host, 0.0))
+            return wait
+
+    def park(self, host, seconds):
+        """Stops requests to host for a number of seconds"""
+        self.parked_until[host] = max(self.parked_until.get(host, 0.0), time.monotonic() + min(seconds, MAX_RETRY_AFTER))
+
+    def throttle(self, host, headers):
+        """Records a 429 response from host"""
+        with self.lock:
+            now = time.monotonic()
+            # Requests that were already in flight when the host was parked don't
+            # lower the rate any further.
+            if now >= self.parked_until.get(host, 0.0):
+                rate = self.rates.get(host)
+                self.rates[host] = THROTTLED_RATE if rate is None else max(MIN_RATE, rate / 2)
+            self.tokens[host] = 0.0
+            self.updated[host] = now
+            self.park(host, retry_after_seconds(headers.get('Retry-After')))
+
+    def observe(self, host, headers):
+        """Records a response from host that wasn't rate limited"""
+        with self.lock:
+            rate = self.rates.get(host)
+            if rate is not None:
+                self.rates[host] = min(MAX_RATE, rate + RATE_INCREASE)
+            # Servers such as GitHub announce their limits before enforcing them.
+            try:
+                remaining = int(headers['X-RateLimit-Remaining'])
+                reset = float(headers['X-RateLimit-Reset'])
+            except (KeyError, ValueError):
+                return
+            # The reset time is either a timestamp or a number of seconds.
+            if reset > 1e9:
+                reset -= time.time()
+            if reset <= 0:
+                return
+            if remaining <= 0:
+                self.park(host, reset)
+            else:
+                self.rates[host] = min(self.rates.get(host, MAX_RATE), max(MIN_RATE, remaining / reset))
+
+    def total_wait(self):
+        """Returns the total time that hosts were held back for"""
+        with self.lock:
+            return sum(self.waited.values())
+
+    def print_stats(self, verbose):
+        """Prints the time that hosts were held back for, per host if verbose"""
+        total = self.total_wait()
+        if total == 0:
+            return
+        print(f'Time lost to rate limiting: {total:.1f} seconds')
+        if verbose:
+            for host, waited in sorted(self.waited.items(), key=lambda item: -item[1]):
+                if waited > 0:
+                    print(f'\t{host}: {waited:.1f} seconds')
+
+rate_limiter = HostRateLimiter()
+
+def retry_after_seconds(value):
+    """Parses a Retry-After header, which holds either a number of seconds or a date"""
+    if value is None:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
 def issue_request(method, url, **kwargs):
-    retries = 0
-
-    while retries < 3:
-        r = method(url, **kwargs)
-        if r.status_code == 429:
-            retry_after = int(r.headers.get("Retry-After", 60))
-            time.sleep(retry_after)
-            retries += 1
-        else:
-            return r
-    raise Exception("Max retries exceeded")
+    """Sends a request, reporting the response to the rate limiter of the host"""
+    r = method(url, timeout=HTTP_TIMEOUT_SECONDS, **kwargs)
+    if r.status_code == 429:
+        rate_limiter.throttle(link_host(url), r.headers)
+        raise RateLimited(url)
+    rate_limiter.observe(link_host(url), r.headers)
+    return r
 
-def access_url(url):
-    global http_headers
-    status = ''
-    is_broken = False
-    try_with_trusted_ca_bundle = False
+def get_session(url, verify=True):
+    """Returns the pooled session used for requests to the host of a url"""
+    global http_sessions
+    key = (link_host(url), verify)
+    with http_sessions_lock:
+        session = http_sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            session.verify = verify
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=http_pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            http_sessions[key] = session
+    return session
+
+def session_stats():
+    """Returns the number of requests sent and connections opened per host"""
+    stats = defaultdict(lambda: [0, 0])
+    with http_sessions_lock:
+        for session in http_sessions.values():
+            # The same adapter is mounted for http:// and https://, so count it once.
+            for adapter in {id(a): a for a in session.adapters.values()}.values():
+                pools = adapter.poolmanager.pools
+                for pool_key in pools.keys():
+                    pool = pools[pool_key]
+                    stats[pool.host][0] += pool.num_requests
+                    stats[pool.host][1] += pool.num_connections
+    return stats
 
+def print_session_stats():
+    """Prints how often connections were reused for each host"""
+    stats = session_stats()
+    if len(stats) == 0:
+        return
+    print('Connection reuse per host:')
+    for host, (num_requests, num_connections) in sorted(stats.items(), key=lambda item: -item[1][0]):
+        print(f'\t{host}: {num_requests} requests over {num_connections} connections')
+
+def response_validators(r):
+    """Returns the cache validators sent with a response"""
+    return {
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+    }
+
+def session_check(url, session, headers, cached=None):
+    """Tests a url with a pooled session, using HEAD first and then GET"""
+    r = issue_request(session.head, url, allow_redirects=True, headers=headers)
+    validators = response_validators(r)
+    # Some sites may return 404 for head but not get, e.g.
+    # https://tls.mbed.org/kb/development/thread-safety-and-multi-threading
+    if r.status_code >= 400:
+        # Allow redirects is already enabled by default for GET.
+        r = issue_request(session.get, url, headers=http_headers)
+    status = r.status_code
+    # The link hasn't changed since it was last found to be good.
+    if status == 304 and cached is not None:
+        status = cached['status']
+        # A 304 need not repeat the validators, so keep the ones it doesn't send.
+        validators = { key: value or cached.get(key) for key, value in validators.items() }
+    return r.status_code >= 400, status, validators
+
+def minimal_headers_check(url):
+    """Tests a url the way `curl -IL` does: a HEAD request with a minimal set of headers,
+    checked against the system trust store and following redirects. Only a 200 counts."""
+    req = urllib.request.Request(url, headers=MINIMAL_HTTP_HEADERS, method='HEAD')
     try:
-        r = issue_request(requests.head, url, allow_redirects=True, headers=http_headers)
-        # Some sites may return 404 for head but not get, e.g.
-        # https://tls.mbed.org/kb/development/thread-safety-and-multi-threading
-        if r.status_code >= 400:
-            # Allow redirects is already enabled by default for GET.
-            r = issue_request(requests.get, url, headers=http_headers)
-
-        if r.status_code >= 400:
-            is_broken = True
-        status = r.status_code
-    except requests.exceptions.SSLError as e:
-        print(str(e))
-        try_with_trusted_ca_bundle = True
+        with urllib.request.urlopen(req, timeout=HTTP_TIMEOUT_SECONDS) as response:
+            status = response.getcode()
+    except urllib.error.HTTPError as e:
+        if e.code == 429:
+            rate_limiter.throttle(link_host(url), e.headers)
+            raise RateLimited(url)
+        status = e.code
+    return status != 200, status, {}
+
+def urllib_check(url):
+    """Tests a url with a GET request from urllib, checked against the system trust store"""
+    req = urllib.request.Request(url, headers=http_headers)
+    try:
+        with urllib.request.urlopen(req, timeout=HTTP_TIMEOUT_SECONDS) as response:
+            return False, response.getcode(), {}
+    except urllib.error.HTTPError as e:
+        if e.code == 429:
+            rate_limiter.throttle(link_host(url), e.headers)
+            raise RateLimited(url)
+        return True, e.code, {}
+
+# Fallback stages tried in order when the requests session finds a link to be broken.
+FALLBACK_STAGES = (
+    ('minimal-headers', minimal_headers_check),
+    ('urllib', urllib_check),
+)
+
+def run_fallback_stage(stage, check, url):
+    """Runs one stage of the fallback chain, recording its time and whether it found the link"""
+    global fallback_stats
+    error = None
+    start = time.perf_counter()
+    try:
+        is_broken, status, validators = check(url)
+    except RateLimited:
+        with fallback_stats_lock:
+            link_attempts[url].append({ 'stage': stage, 'status': 429, 'seconds': time.perf_counter() - start })
+        raise
     except Exception as e:
-        print(str(e))
-        is_broken = True
-        status = 'Error'
+        is_broken, status, validators, error = True, 'Error', {}, e
+    elapsed = time.perf_counter() - start
+    with fallback_stats_lock:
+        link_attempts[url].append({ 'stage': stage, 'status': status, 'seconds': elapsed })
+        stats = fallback_stats[stage]
+        stats[FALLBACK_ATTEMPTS_KEY] += 1
+        stats[FALLBACK_SECONDS_KEY] += elapsed
+        if not is_broken:
+            stats[FALLBACK_GOOD_KEY] += 1
+    return is_broken, status, validators, error
 
-    if try_with_trusted_ca_bundle == True:
-        try:
-            r = issue_request(requests.head, url, allow_redirects=True, headers=http_headers, verify=TRUSTED_CA_BUNDLE)
-            # Some sites may return 404 for head but not get, e.g.
-            # https://tls.mbed.org/kb/development/thread-safety-and-multi-threading
-            if r.status_code >= 400:
-                # Allow redirects is already enabled by default for GET.
-                r = issue_request(requests.get, url, headers=http_headers, verify=TRUSTED_CA_BUNDLE)
-
-            if r.status_code >= 400:
-                is_broken = True
-            status = r.status_code
-        except Exception as e:
-            print(str(e))
-            is_broken = True
-            status = 'Error'
-
-    # Use curl as a fallback.
-    if is_broken == True:
-        curl_cmd = f'curl -sIL -o /dev/null -w "%{{http_code}}" {url}'
-        process = subprocess.run(
-            curl_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            shell=True,
-            encoding="utf-8",
-            universal_newlines=True
-        )
-        http_status_code = int(process.stdout)
-        if http_status_code == 200:
-            is_broken = False
-            status = http_status_code
+def print_fallback_stats():
+    """Prints how often each fallback stage ran, how often it found a link, and its cost"""
+    if len(fallback_stats) == 0:
+        return
+    print('Fallback stages:')
+    for stage, stats in fallback_stats.items():
+        print(f'\t{stage}: {stats[FALLBACK_GOOD_KEY]} of {stats[FALLBACK_ATTEMPTS_KEY]} links good, ' +
+              f'{stats[FALLBACK_SECONDS_KEY]:.2f} seconds')
 
-    # Use urllib as a fallback.
-    if is_broken == True:
-        req = urllib.request.Request(url, headers=http_headers)
-        try:
-            response = urllib.request.urlopen(req)
+def access_url(url, cached=None):
+    """Tests a single url over the network. If a previous result is passed in, its
+    validators are used to make the first request conditional. Also returns the name of
+    the stage that decided the result."""
+    global http_headers
+    head_headers = http_headers
+    if cached is not None and not cached['broken']:
+        head_headers = http_headers.copy()
+        if cached.get('etag'):
+            head_headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            head_headers['If-Modified-Since'] = cached['last_modified']
+
+    decided_by = 'requests'
+    is_broken, status, validators, error = run_fallback_stage(
+        'requests', lambda u: session_check(u, get_session(u), head_headers, cached), url)
+    if isinstance(error, requests.exceptions.SSLError):
+        print(str(error))
+        decided_by = 'trusted-ca'
+        is_broken, status, validators, error = run_fallback_stage(
+            'trusted-ca', lambda u: session_check(u, get_session(u, TRUSTED_CA_BUNDLE), http_headers), url)
+    if error is not None:
+        print(str(error))
+
+    # Fall back to checks that use a different TLS trust store, header set and redirect
+    # handling, as some servers reject the requests above but serve browsers fine.
+    for stage, check in FALLBACK_STAGES:
+        if not is_broken:
+            break
+        stage_broken, stage_status, _, error = run_fallback_stage(stage, check, url)
+        if not stage_broken:
             is_broken = False
-            status = response.getcode()
-        except (urllib.error.HTTPError, urllib.error.URLError) as e:
-            print(f"urllib: {url} error: {e}")
+            status = stage_status
+            decided_by = stage
+        elif error is not None:
+            print(f"{stage}: {url} error: {error}")
 
-    return is_broken, status
+    return is_broken, status, validators, decided_by
 
 def test_url(url):
-    """Tests a single url"""
+    """Tests a single url, given in the canonical form that its result is cached under."""
     global use_gh_cache
     global main_repo_list
     global link_cache
+    global persistent_cache
     status = ''
     is_broken = False
     # Test if link was already tested before.
@@ -288,91 +977,450 @@ def test_url(url):
         return link_cache[url]
     # Test if link was cached in pre-fetched GitHub issues. If not, send a request for the link.
     if use_gh_cache:
-        pr_match = re.search(PULL_REQUEST_SEARCH, url)
-        issue_match = re.search(ISSUE_SEARCH, url)
-        if pr_match is not None:
-            repo_key = f'{pr_match.group(1)}/{pr_match.group(2)}'.lower()
-            if repo_key in main_repo_list and PR_KEY in main_repo_list[repo_key]:
-                if int(pr_match.group(3)) in main_repo_list[repo_key][PR_KEY]:
-                    status = 'Good'
-        elif issue_match is not None:
-            repo_key = f'{issue_match.group(1)}/{issue_match.group(2)}'.lower()
-            if repo_key in main_repo_list and ISSUE_KEY in main_repo_list[repo_key]:
-                if int(issue_match.group(3)) in main_repo_list[repo_key][ISSUE_KEY]:
+        gh_match = match_gh_link(url)
+        if gh_match is not None:
+            repo_key, number, is_pr = gh_match
+            if repo_key in main_repo_list:
+                if number in main_repo_list[repo_key][PR_KEY if is_pr else ISSUE_KEY]:
                     status = 'Good'
+                    link_stage[url] = 'github'
     if status != 'Good':
-        is_broken, status = access_url(url)
+        # Use the result from a previous run if it hasn't expired yet.
+        cached = persistent_cache.get(url)
+        if cached is not None and time.time() - cached['checked'] < cache_ttl[cached['broken']]:
+            is_broken, status = cached['broken'], cached['status']
+            link_stage[url] = 'cache'
+        else:
+            is_broken, status, validators, link_stage[url] = access_url(url, cached)
+            persistent_cache[url] = {
+                'url': url,
+                'broken': is_broken,
+                'status': status,
+                'checked': time.time(),
+                'etag': validators.get('etag'),
+                'last_modified': validators.get('last_modified'),
+            }
 
     # Add result to cache so it won't be tested again.
     link_cache[url] = (is_broken, status)
     return is_broken, status
 
-def fetch_issues(repo, issue_type, limit):
-    """Uses the GitHub CLI to fetch a list of PRs or issues"""
+def load_persistent_cache(cache_file):
+    """Loads link results saved by a previous run"""
+    global persistent_cache
+    if not os.path.exists(cache_file):
+        return
+    with open(cache_file, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line == '':
+                continue
+            try:
+                entry = json.loads(line)
+                persistent_cache[entry['url']] = entry
+            except (ValueError, KeyError):
+                # Skip corrupted entries, the link will simply be tested again.
+                continue
 
-    global use_gh_cache
-    global main_repo_list
-    if shutil.which('gh') is not None:
-        # List PRs or issues for repository and extract numbers.
-        cmd = f'gh {issue_type} list -R {repo} -s all -L {limit} | awk \'{{print $1}}\''
+def save_persistent_cache(cache_file):
+    """Saves link results so that following runs only test expired links"""
+    global persistent_cache
+    now = time.time()
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as file:
+        for url in sorted(persistent_cache):
+            entry = persistent_cache[url]
+            if now - entry['checked'] < CACHE_RETENTION_SECONDS:
+                file.write(json.dumps(entry) + '\n')
+    # Replace the cache file in one step so an interrupted run can't corrupt it.
+    os.replace(tmp_file, cache_file)
+
+def load_link_manifest(manifest_file):
+    """Loads the links found by full runs at previous revisions"""
+    global link_manifest
+    if not os.path.exists(manifest_file):
+        return
+    try:
+        with open(manifest_file, 'r') as file:
+            link_manifest = json.load(file)
+    except ValueError:
+        # A corrupted manifest only means that more links are tested.
+        link_manifest = {}
+
+def save_link_manifest(manifest_file, revision, links):
+    """Records the good links found at a revision, keeping the most recent revisions"""
+    global link_manifest
+    link_manifest.pop(revision, None)
+    link_manifest[revision] = sorted(links)
+    while len(link_manifest) > MANIFEST_MAX_REVISIONS:
+        del link_manifest[next(iter(link_manifest))]
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as file:
+        json.dump(link_manifest, file, indent=1)
+    os.replace(tmp_file, manifest_file)
+
+def git_output(*args):
+    """Runs a git command and returns its output"""
+    process = subprocess.run(
+        ['git'] + list(args),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        encoding="utf-8",
+        check=True
+    )
+    return process.stdout
+
+def git_changed_files(base_revision):
+    """Returns the files changed since base_revision, relative to the current directory.
+    Uncommitted and untracked files are included."""
+    changed = git_output('diff', '-z', '--name-only', '--relative', '--diff-filter=d', base_revision)
+    changed += git_output('ls-files', '-z', '--others', '--exclude-standard')
+    return set(os.path.normpath(f) for f in changed.split('\0') if f != '')
+
+def manifest_links(base_revision):
+    """Returns the links of the most recent revision in the manifest that is the base
+    revision or one of its ancestors, and that revision"""
+    for revision in git_output('rev-list', f'--max-count={MANIFEST_SEARCH_DEPTH}', base_revision).split():
+        if revision in link_manifest:
+            return set(link_manifest[revision]), revision
+    return set(), None
+
+def end_phase(phase, start):
+    """Adds the time since start to a phase of the run. Returns the start of the next phase."""
+    now = time.perf_counter()
+    phase_times[phase] = phase_times.get(phase, 0.0) + now - start
+    return now
+
+def latency_histogram(latencies):
+    """Summarizes the time taken to test the links of a host"""
+    histogram = { f'<={bound}': 0 for bound in LATENCY_BUCKETS }
+    histogram[f'>{LATENCY_BUCKETS[-1]}'] = 0
+    for latency in latencies:
+        bucket = next((f'<={bound}' for bound in LATENCY_BUCKETS if latency <= bound), f'>{LATENCY_BUCKETS[-1]}')
+        histogram[bucket] += 1
+    return {
+        'links': len(latencies),
+        'total_seconds': round(sum(latencies), 4),
+        'max_seconds': round(max(latencies), 4),
+        'histogram': histogram,
+    }
+
+def build_report(link_sources, link_keys):
+    """Builds a report of the result of every link, with the time taken to test them.
+    Each spelling of a link gets a record, with the result of its canonical form."""
+    links = []
+    host_latencies = {}
+    for url in sorted(link_sources):
+        key = link_keys[url]
+        is_broken, status = link_cache.get(key, (True, 'Untested'))
+        attempts = [
+            { 'stage': a['stage'], 'status': a['status'], 'seconds': round(a['seconds'], 4) }
+            for a in link_attempts.get(key, [])
+        ]
+        seconds = sum(a['seconds'] for a in attempts)
+        if len(attempts) > 0:
+            host_latencies.setdefault(link_host(key), {})[key] = seconds
+        links.append({
+            'url': url,
+            'canonical': key,
+            'files': sorted(link_sources[url]),
+            'broken': is_broken,
+            'status': status,
+            'stage': link_stage.get(key),
+            'attempts': attempts,
+            'seconds': round(seconds, 4),
+        })
+    local_links = [
+        { 'file': file, 'link': link, 'broken': status != 'Good', 'status': status }
+        for file, link, status in local_link_results
+    ]
+    return {
+        'summary': {
+            'links': len(links),
+            'probes': len(set(link['canonical'] for link in links)),
+            'broken': sum(link['broken'] for link in links),
+            'local_links': len(local_links),
+            'local_broken': sum(link['broken'] for link in local_links),
+            'throttled_seconds': round(rate_limiter.total_wait(), 4),
+        },
+        'phases': { phase: round(seconds, 4) for phase, seconds in phase_times.items() },
+        'hosts': { host: latency_histogram(list(latencies.values())) for host, latencies in sorted(host_latencies.items()) },
+        'links': links,
+        'local_links': local_links,
+    }
+
+def write_json_report(report_file, report):
+    """Writes the report as JSON"""
+    with open(report_file, 'w') as file:
+        json.dump(report, file, indent=2)
+
+def write_junit_report(report_file, report):
+    """Writes the report as JUnit XML, with a test case per link"""
+    testsuites = ET.Element('testsuites')
+    suite = ET.SubElement(testsuites, 'testsuite', {
+        'name': 'links',
+        'tests': str(len(report['links'])),
+        'failures': str(report['summary']['broken']),
+        'time': str(round(phase_times.get('http', 0.0), 4)),
+    })
+    for link in report['links']:
+        case = ET.SubElement(suite, 'testcase', {
+            'classname': link_host(link['url']),
+            'name': link['url'],
+            'time': str(link['seconds']),
+        })
+        if link['broken']:
+            ET.SubElement(case, 'failure', { 'message': str(link['status']) }).text = '\n'.join(link['files'])
+        ET.SubElement(case, 'system-out').text = '\n'.join(
+            f"{a['stage']}: {a['status']} in {a['seconds']}s" for a in link['attempts'])
+    suite = ET.SubElement(testsuites, 'testsuite', {
+        'name': 'local links',
+        'tests': str(len(report['local_links'])),
+        'failures': str(report['summary']['local_broken']),
+    })
+    for link in report['local_links']:
+        case = ET.SubElement(suite, 'testcase', { 'classname': link['file'], 'name': link['link'] })
+        if link['broken']:
+            ET.SubElement(case, 'failure', { 'message': link['status'] })
+    ET.ElementTree(testsuites).write(report_file, encoding='utf-8', xml_declaration=True)
+
+def extract_urls(file_path):
+    """Searches a file for URLs in a single streaming pass"""
+    url_search = re.compile(URL_SEARCH_TERM)
+    urls = set()
+    carry = ''
+    # errors='ignore' argument Suppresses UnicodeDecodeError
+    # when reading invalid UTF-8 characters.
+    with open(file_path, 'r', encoding="utf8", errors='ignore') as f:
+        while True:
+            chunk = f.read(URL_SCAN_CHUNK_SIZE)
+            if chunk == '':
+                break
+            text = carry + chunk
+            # URLs never contain whitespace, so the text up to the last whitespace can be
+            # searched now. What follows may be a URL that continues in the next chunk.
+            end = max(text.rfind(c) for c in ' \t\n\r\f\v') + 1
+            if end == 0:
+                if len(text) < URL_SCAN_MAX_CARRY:
+                    carry = text
+                    continue
+                end = len(text)
+            urls.update(url[0] for url in url_search.findall(text, 0, end))
+            carry = text[end:]
+        urls.update(url[0] for url in url_search.findall(carry))
+    return file_path, urls
+
+def strip_link(link):
+    """Remove the trailing slash or trailing comma from a link before testing it"""
+    if link[-1:] == "/" or link[-1:] == ",":
+        return link[:-1]
+    return link
+
+def canonical_url(link):
+    """Returns the key under which a link is tested. Spellings of a link that send the same
+    request share a key: the scheme and host are lowercased, default ports, fragments and
+    tracking query parameters are dropped, along with any trailing slashes or commas."""
+    link = link.rstrip('/,')
+    try:
+        parts = urllib.parse.urlsplit(link)
+        port = parts.port
+    except ValueError:
+        return link
+    if parts.hostname is None:
+        return link
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname
+    if ':' in netloc:
+        netloc = f'[{netloc}]'
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        netloc += f':{port}'
+    userinfo, at, _ = parts.netloc.rpartition('@')
+    if at:
+        netloc = f'{userinfo}@{netloc}'
+    query = '&'.join(
+        parameter for parameter in parts.query.split('&')
+        if parameter != '' and not re.match(TRACKING_QUERY_PARAMETERS, parameter.split('=', 1)[0], re.IGNORECASE)
+    )
+    # Strip every trailing slash and comma, so a canonical url is its own canonical form.
+    return urllib.parse.urlunsplit((scheme, netloc, parts.path, query, '')).rstrip('/,')
+
+def link_host(link):
+    """Returns the lowercase host name of a link, used to group requests per server"""
+    try:
+        return (urllib.parse.urlsplit(link).hostname or '').lower()
+    except ValueError:
+        return ''
+
+async def test_links_async(links, max_concurrency, max_per_host):
+    """Test links concurrently, bounded by a global and a per-host concurrency limit"""
+    loop = asyncio.get_running_loop()
+    global_limit = asyncio.Semaphore(max_concurrency)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(max_per_host))
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        async def test_one(link):
+            host = link_host(link)
+            # Take the host slot first so that links to a busy host queue up
+            # without holding on to one of the global slots.
+            async with host_limits[host]:
+                for _ in range(RATE_LIMIT_TRIES):
+                    # Waiting for a rate limited host only holds up that host's links.
+                    wait = rate_limiter.reserve(host)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    async with global_limit:
+                        try:
+                            await loop.run_in_executor(executor, test_url, link)
+                            return
+                        except RateLimited:
+                            pass
+                link_cache[link] = (True, 429)
+                link_stage[link] = 'rate-limit'
+
+        await asyncio.gather(*(test_one(link) for link in links))
+
+def test_links(links, max_concurrency, max_per_host):
+    """Test a set of canonical links concurrently, filling link_cache with the results"""
+    global link_cache
+    # Links that were already tested or allowed don't need to be scheduled again.
+    pending = sorted(set(links) - link_cache.keys())
+    if len(pending) > 0:
+        asyncio.run(test_links_async(pending, max(1, max_concurrency), max(1, max_per_host)))
+
+def match_gh_link(link):
+    """Returns the repository, number and type of a link to a GitHub PR or issue"""
+    pr_match = re.search(PULL_REQUEST_SEARCH, link)
+    if pr_match is not None:
+        return f'{pr_match.group(1)}/{pr_match.group(2)}'.lower(), int(pr_match.group(3)), True
+    issue_match = re.search(ISSUE_SEARCH, link)
+    if issue_match is not None:
+        return f'{issue_match.group(1)}/{issue_match.group(2)}'.lower(), int(issue_match.group(3)), False
+    return None
+
+def add_gh_link(repo_list, link):
+    """Records the PR or issue number of a GitHub link in a repository list"""
+    gh_match = match_gh_link(link)
+    if gh_match is None:
+        return
+    repo_key, number, is_pr = gh_match
+    if repo_key not in repo_list:
+        repo_list[repo_key] = { LINKED_PR_KEY : set(), LINKED_IS_KEY : set() }
+    repo_list[repo_key][LINKED_PR_KEY if is_pr else LINKED_IS_KEY].add(number)
+
+class GhCliBackend:
+    """Runs GitHub GraphQL queries through the GitHub CLI"""
+
+    name = 'gh'
+
+    def available(self):
+        return shutil.which('gh') is not None
+
+    def query(self, query):
         process = subprocess.run(
-            cmd,
+            ['gh', 'api', 'graphql', '-f', f'query={query}'],
             stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            shell=True,
+            stderr=subprocess.PIPE,
             encoding="utf-8",
-            universal_newlines=True
+            universal_newlines=True,
+            timeout=HTTP_TIMEOUT_SECONDS
         )
-        if process.returncode == 0:
-            key = issue_type + 's'
-            for issue in process.stdout.split():
-                if(issue.isnumeric()):
-                    main_repo_list[repo][key].add(int(issue))
-                else:
-                    raise TypeError(f"Attempted to cast {issue} as an int. Error fetching GitHub Issues")
-        return 0
-    else:
-        use_gh_cache = False
+        # gh exits with an error when any number doesn't exist, but still prints the data.
+        try:
+            return json.loads(process.stdout)
+        except ValueError:
+            raise RuntimeError(f'gh api graphql failed: {process.stderr.strip()}')
+
+class HttpGraphQLBackend:
+    """Sends GitHub GraphQL queries to an HTTP endpoint, either GitHub or a local stand-in"""
+
+    name = 'http'
+
+    def __init__(self, url, token):
+        self.url = url
+        self.token = token
+
+    def available(self):
+        # GitHub requires a token, but a local stand-in server may not.
+        return self.token is not None or self.url != GITHUB_GRAPHQL_URL
+
+    def query(self, query):
+        headers = { 'User-Agent': http_headers['User-Agent'] }
+        if self.token is not None:
+            headers['Authorization'] = f'bearer {self.token}'
+        r = requests.post(self.url, json={ 'query': query }, headers=headers, timeout=HTTP_TIMEOUT_SECONDS)
+        r.raise_for_status()
+        return r.json()
+
+def gh_backend(name, graphql_url):
+    """Returns the backend used to resolve GitHub PRs and issues, or None to test them over HTTP"""
+    token = os.environ.get('GITHUB_TOKEN') or os.environ.get('GH_TOKEN')
+    backends = {
+        'gh': [GhCliBackend()],
+        'http': [HttpGraphQLBackend(graphql_url, token)],
+        'auto': [GhCliBackend(), HttpGraphQLBackend(graphql_url, token)],
+        'none': [],
+    }
+    for backend in backends[name]:
+        if backend.available():
+            return backend
+    return None
+
+def gh_batch_query(owner, repo, numbers):
+    """Builds a GraphQL query for the existence and type of a batch of PR or issue numbers"""
+    fields = ' '.join(f'n{number}: issueOrPullRequest(number: {number}) {{ __typename }}' for number in numbers)
+    return f'query {{ repository(owner: "{owner}", name: "{repo}") {{ {fields} }} }}'
+
+def resolve_gh_links(backend, verbose):
+    """Resolves every linked PR and issue number in bulk queries against the backend"""
+
+    global use_gh_cache
+    global main_repo_list
+    num_queries = 0
+    for repo_key, repo_info in main_repo_list.items():
+        owner, repo = repo_key.split('/')
+        numbers = sorted(repo_info[LINKED_PR_KEY] | repo_info[LINKED_IS_KEY])
+        for i in range(0, len(numbers), GITHUB_BATCH_SIZE):
+            response = backend.query(gh_batch_query(owner, repo, numbers[i:i + GITHUB_BATCH_SIZE]))
+            num_queries += 1
+            repository = (response.get('data') or {}).get('repository')
+            # The repository doesn't exist, so leave the links to be tested individually.
+            if repository is None:
+                break
+            for field, item in repository.items():
+                if item is None:
+                    continue
+                number = int(field[1:])
+                if item['__typename'] == 'PullRequest':
+                    repo_info[PR_KEY].add(number)
+                # GitHub redirects links to an issue number to the PR with that number.
+                repo_info[ISSUE_KEY].add(number)
+    if verbose:
+        print(f'Resolved GitHub PRs and issues for {len(main_repo_list)} repositories ' +
+              f'in {num_queries} {backend.name} queries')
 
 def consolidate_repo_list(repo_list):
     """Combines each list of repos into a single main list"""
 
-    global use_gh_cache
     global main_repo_list
-    for repo, stats in repo_list.items():
+    for repo, linked in repo_list.items():
         if repo not in main_repo_list:
-            main_repo_list[repo] = stats
-            main_repo_list[repo][PR_CACHED_KEY] = False
-            main_repo_list[repo][ISSUE_CACHED_KEY] = False
-            main_repo_list[repo][PR_KEY] = set()
-            main_repo_list[repo][ISSUE_KEY] = set()
-        else:
-            main_repo_list[repo][NUM_PR_KEY] += stats[NUM_PR_KEY]
-            main_repo_list[repo][NUM_IS_KEY] += stats[NUM_IS_KEY]
-        # Fetch the list of GH PRs and cache them. If we run into an error then we
-        # stop trying to use the cached list.
-        if use_gh_cache:
-            if main_repo_list[repo][NUM_PR_KEY] > GITHUB_FETCH_THRESHOLD and main_repo_list[repo][PR_CACHED_KEY] == False:
-                try:
-                    fetch_issues(repo, 'pr', 1500)
-                except Exception as e:
-                    traceback.print_exc()
-                    use_gh_cache = False
-                main_repo_list[repo][PR_CACHED_KEY] = True
-            if main_repo_list[repo][NUM_IS_KEY] > GITHUB_FETCH_THRESHOLD and main_repo_list[repo][ISSUE_CACHED_KEY] == False:
-                try:
-                    fetch_issues(repo, 'issue', 1000)
-                except Exception as e:
-                    traceback.print_exc()
-                    use_gh_cache = False
-                main_repo_list[repo][ISSUE_CACHED_KEY] = True
+            main_repo_list[repo] = {
+                LINKED_PR_KEY : set(),
+                LINKED_IS_KEY : set(),
+                PR_KEY : set(),
+                ISSUE_KEY : set(),
+            }
+        main_repo_list[repo][LINKED_PR_KEY] |= linked[LINKED_PR_KEY]
+        main_repo_list[repo][LINKED_IS_KEY] |= linked[LINKED_IS_KEY]
 
 def main():
     global http_headers
+    global http_pool_size
+    global use_gh_cache
     parser = argparse.ArgumentParser(
         description='A script to test HTTP links, and all links in Markdown files.',
         epilog='Requires beautifulsoup4, requests, and termcolor from PyPi. ' +
-               'Optional dependencies: pandoc (to support testing Markdown files), gh (To speed up checking GitHub links)'
+               'Optional dependencies: pandoc (for --pandoc), gh or GITHUB_TOKEN (To speed up checking GitHub links)'
     )
     parser.add_argument("-F", "--files", action="store", dest="files", nargs='+', help="List of Markdown files to test links in.")
     parser.add_argument("-L", "--links", action="store", dest="links", nargs='+', help="List of links to test.")
@@ -380,7 +1428,20 @@ def main():
     parser.add_argument("-D", "--exclude-dirs", action="store", dest="exclude_dirs", nargs='+', help="List of directories to ignore.")
     parser.add_argument("-I", "--include-file-types", action="store", dest="include_files", nargs='+', help="List of file patterns to search for URLs.")
     parser.add_argument("-A", "--allowlist-file", action="store", dest="allowlist", help="Path to file containing list of allowed URLs.")
+    parser.add_argument("-G", "--github-backend", action="store", choices=['auto', 'gh', 'http', 'none'], default='auto', help="How to resolve links to GitHub PRs and issues in bulk")
+    parser.add_argument("--github-graphql-url", action="store", default=GITHUB_GRAPHQL_URL, help="GraphQL endpoint used by the http GitHub backend")
+    parser.add_argument("-P", "--pool-size", action="store", type=int, default=DEFAULT_POOL_SIZE, help="Number of connections kept open per host")
+    parser.add_argument("-C", "--cache-file", action="store", dest="cache_file", help="Path to file used to keep link results between runs.")
+    parser.add_argument("--cache-ttl-good", action="store", type=int, default=DEFAULT_CACHE_TTL_GOOD, help="Seconds for which a cached good link is not tested again")
+    parser.add_argument("-B", "--base-revision", action="store", dest="base_revision", help="Only search files changed since this git revision, and only test links that are new since it")
+    parser.add_argument("--link-manifest", action="store", dest="link_manifest", help="Path to file listing the good links found by full runs at each revision")
+    parser.add_argument("--cache-ttl-bad", action="store", type=int, default=DEFAULT_CACHE_TTL_BAD, help="Seconds for which a cached broken link is not tested again")
+    parser.add_argument("-R", "--report", action="store", dest="report", help="Path to file to write a report of every link to")
+    parser.add_argument("--report-format", action="store", choices=['json', 'junit'], default='json', help="Format of the report")
     parser.add_argument("-n", "--num-processes", action="store", type=int, default=4, help="Number of processes to run in parallel")
+    parser.add_argument("-c", "--max-concurrency", action="store", type=int, default=DEFAULT_MAX_CONCURRENCY, help="Maximum number of links to test at the same time")
+    parser.add_argument("-H", "--max-per-host", action="store", type=int, default=DEFAULT_MAX_PER_HOST, help="Maximum number of links to test at the same time on a single host")
+    parser.add_argument("--pandoc", action="store_true", default=False, help="Convert Markdown files to HTML with pandoc to find links, instead of parsing the Markdown directly")
     parser.add_argument("-k", "--keep", action="store_true", default=False, help="Keep temporary files instead of deleting")
     parser.add_argument("-u", "--user-agent", action="store", dest="user_agent", default=None, help="User agent to use for HTTP requests")
     parser.add_argument("-v", "--verbose", action="store_true", default=False, help="Print all links tested")
@@ -393,73 +1454,167 @@ def main():
     link_to_files = defaultdict(set)
     exclude_dirs = [dir.lower() for dir in args.exclude_dirs] if args.exclude_dirs else []
 
+    http_pool_size = max(1, args.pool_size)
+
     if args.user_agent != None:
         http_headers.update({ 'User-Agent': args.user_agent })
 
     if args.verbose:
         print("Using User-Agent: {}".format(http_headers['User-Agent']))
 
+    phase_start = time.perf_counter()
+
+    # Walk the repository once for both Markdown files and files to search for URLs.
+    # The same snapshot is used to test links to files and directories.
+    tree_files = []
+    if (args.files is None and args.test_markdown) or (args.links is None and args.include_files is not None):
+        tree_files = snapshot_tree("./", exclude_dirs)
+        if args.verbose:
+            print(f'Found {len(tree_entries)} files and directories')
+
     # If any explicit files are passed, add them to md_file_list.
     if args.files is not None:
         md_file_list = args.files
     elif args.test_markdown:
-        # Obtain list of Markdown files from the repository (along with excluding passed directories).
-        for root, dirs, files in os.walk("./"):
-            # Prune dirs to remove exclude directories, if passed as command line input, from search.
-            dirs[:] = [dir for dir in dirs if dir.lower() not in exclude_dirs]
-            md_file_list += [os.path.join(root, f) for f in files if re.search(MARKDOWN_SEARCH_TERM, f, re.IGNORECASE)]
+        # Obtain list of Markdown files from the repository.
+        md_file_list = [f for f in tree_files if re.search(MARKDOWN_SEARCH_TERM, os.path.basename(f), re.IGNORECASE)]
+
+    # In incremental mode, only search the files that changed since the base revision.
+    changed_files = None
+    if args.base_revision is not None:
+        try:
+            changed_files = git_changed_files(args.base_revision)
+        except (OSError, subprocess.CalledProcessError) as error:
+            # A shallow checkout doesn't have the base revision, so test everything instead.
+            reason = (getattr(error, 'stderr', None) or str(error)).strip().split('\n')[0]
+            cprint(f'Could not find the files changed since {args.base_revision}, testing all files: {reason}', 'yellow')
+            args.base_revision = None
+    if changed_files is not None:
+        md_file_list = [f for f in md_file_list if os.path.normpath(f) in changed_files]
+        if args.verbose:
+            print(f'{len(changed_files)} files changed since {args.base_revision}')
 
     # If any explicit links are passed, add them to link_set.
     if args.links is not None:
         link_set = set(args.links)
     # Otherwise walk the file tree to discover links
     elif args.include_files is not None:
-        for root, dirs, files in os.walk("./"):
-            # Avoid exclude directories, if passed, from search.
-            dirs[:] = [dir for dir in dirs if dir.lower() not in exclude_dirs]
-            for file in files:
-                if any(file.endswith(file_type) for file_type in args.include_files):
-                    f_path = os.path.join(root, file)
-                    if args.verbose:
-                        print("\nProcessing File: {}".format(f_path))
-                    with open(f_path, 'r', encoding="utf8", errors='ignore') as f:
-                        # errors='ignore' argument Suppresses UnicodeDecodeError
-                        # when reading invalid UTF-8 characters.
-                        text = f.read()
-                        urls = re.findall(URL_SEARCH_TERM, text)
-                        for url in urls:
-                            link_set.add(url[0])
-                            link_to_files[url[0]].add(f_path)
+        scan_file_list = [f for f in tree_files if any(f.endswith(file_type) for file_type in args.include_files)]
+        if changed_files is not None:
+            scan_file_list = [f for f in scan_file_list if os.path.normpath(f) in changed_files]
+        # Search files in parallel, building an index of the files each URL appears in.
+        with Pool(args.num_processes) as pool:
+            for f_path, urls in pool.imap_unordered(extract_urls, scan_file_list, chunksize=16):
+                if args.verbose:
+                    print("\nProcessing File: {}".format(f_path))
+                for url in urls:
+                    link_set.add(url)
+                    link_to_files[url].add(f_path)
+
+    phase_start = end_phase('discovery', phase_start)
 
     # If allowlist file is passed, add those links to link_cache so that link check on those URLs can be bypassed.
     if args.allowlist is not None:
         with open(args.allowlist, 'r') as file:
             for link in file.read().strip('\n').split('\n'):
-                link_cache[link] = (False, 'Allowed')
+                link_cache[canonical_url(link)] = (False, 'Allowed')
+                link_stage[canonical_url(link)] = 'allowlist'
 
+    if args.link_manifest is not None:
+        load_link_manifest(args.link_manifest)
+
+    # If a cache file is passed, load the results of previous runs.
+    if args.cache_file is not None:
+        cache_ttl[False] = args.cache_ttl_good
+        cache_ttl[True] = args.cache_ttl_bad
+        load_persistent_cache(args.cache_file)
+
+    # Each link found is canonicalized once, and tested and reported under that key.
+    link_keys = { link: canonical_url(link) for link in link_set }
+    link_sources = defaultdict(set)
+    phase_start = end_phase('cache', phase_start)
     try:
         file_map = {}
-        for f in md_file_list:
-            process = create_html(f)
-            if process.returncode != 0:
-                cprint(process.stdout, 'red')
-                print('Did you install pandoc?')
-                sys.exit(process.returncode)
-            html_file_list.append(html_name_from_markdown(f))
-            # Create a map so that we know what file this was generated from.
-            file_map[html_name_from_markdown(f)] = f
+        if args.pandoc:
+            for f in md_file_list:
+                process = create_html(f)
+                if process.returncode != 0:
+                    cprint(process.stdout, 'red')
+                    print('Did you install pandoc?')
+                    sys.exit(process.returncode)
+                html_file_list.append(html_name_from_markdown(f))
+                # Create a map so that we know what file this was generated from.
+                file_map[html_name_from_markdown(f)] = f
+        else:
+            file_map = { f: f for f in md_file_list }
 
         # Parse files in parallel.
         pool = Pool(args.num_processes)
-        file_objects = pool.map(parse_file, html_file_list)
+        if args.pandoc:
+            file_objects = pool.map(parse_file, html_file_list)
+        else:
+            file_objects = pool.map(parse_markdown_file, md_file_list)
         pool.close()
         pool.join()
         for file_obj in file_objects:
             consolidate_repo_list(file_obj.linked_repos)
-        # Test links in series so we don't send too many HTTP requests in a short interval.
+            file_anchors[os.path.abspath(file_map[file_obj.name])] = file_obj.ids
+        link_set_repos = {}
+        for link in link_set:
+            add_gh_link(link_set_repos, link_keys[link])
+        consolidate_repo_list(link_set_repos)
+        phase_start = end_phase('parse', phase_start)
+        # Resolve links to GitHub PRs and issues in bulk. If we run into an error then we
+        # stop trying to use the resolved list and test the links individually.
+        backend = gh_backend(args.github_backend, args.github_graphql_url)
+        if backend is None:
+            use_gh_cache = False
+        elif len(main_repo_list) > 0:
+            try:
+                resolve_gh_links(backend, args.verbose)
+            except (requests.exceptions.Timeout, subprocess.TimeoutExpired):
+                cprint(f'GitHub {backend.name} query timed out, testing PR and issue links over HTTP', 'yellow')
+                use_gh_cache = False
+            except Exception as e:
+                traceback.print_exc()
+                use_gh_cache = False
+        phase_start = end_phase('github', phase_start)
+        # Test the union of all external links up front, concurrently. The per-file
+        # reports below are then served from link_cache.
+        spelling_keys = {}
+        for link in link_set:
+            link_sources[strip_link(link)].update(link_to_files[link])
+            spelling_keys[strip_link(link)] = link_keys[link]
+        for file_obj in file_objects:
+            for link, key in file_obj.external_links.items():
+                link_sources[strip_link(link)].add(file_map[file_obj.name])
+                spelling_keys[strip_link(link)] = key
+        # Spellings of the same link are tested once.
+        all_links = set(spelling_keys.values())
+        if args.verbose:
+            print(f'Testing {len(all_links)} links for {len(link_sources)} spellings')
+        # In incremental mode, links that were good at the base revision aren't tested
+        # again. Explicitly passed links always are.
+        if args.base_revision is not None:
+            known_links, revision = manifest_links(args.base_revision)
+            explicit_links = set(link_keys[link] for link in args.links or [])
+            num_known = 0
+            for link in all_links - explicit_links:
+                if link in known_links and link not in link_cache:
+                    link_cache[link] = (False, 'Unchanged')
+                    link_stage[link] = 'manifest'
+                    num_known += 1
+            if args.verbose:
+                if revision is None:
+                    print(f'No links in the manifest for {args.base_revision}, testing all links')
+                else:
+                    print(f'Skipping {num_known} links found at {revision}')
+        test_links(all_links, args.max_concurrency, args.max_per_host)
+        phase_start = end_phase('http', phase_start)
         for file_obj in file_objects:
             file_obj.identify_broken_links(file_map, args.verbose)
             broken_links += file_obj.broken_links
+        phase_start = end_phase('local', phase_start)
     # Remove the temporary files we created, especially if there was an exception.
     finally:
         for f in html_file_list:
@@ -467,10 +1622,7 @@ def main():
                 os.remove(f)
 
     for link in link_set:
-        if ( ( link[-1] == "/" ) or ( link[-1] == "," ) ):
-            is_broken, status_code = test_url(link[:-1])
-        else:
-            is_broken, status_code = test_url(link)
+        is_broken, status_code = test_url(link_keys[link])
         if is_broken:
             broken_links.append(link)
             print("FILES:", link_to_files[link])
@@ -480,6 +1632,30 @@ def main():
                 print("FILES:", link_to_files[link])
                 cprint(f'\t{status_code}\t{link}', 'green')
 
+    if args.cache_file is not None:
+        save_persistent_cache(args.cache_file)
+
+    # Only a full run knows all the links at a revision.
+    if args.link_manifest is not None and args.base_revision is None:
+        try:
+            revision = git_output('rev-parse', 'HEAD').strip()
+            save_link_manifest(args.link_manifest, revision,
+                (link for link in all_links if link_cache.get(link, (True,))[0] is False and link_cache[link][1] != 'Allowed'))
+        except subprocess.CalledProcessError as e:
+            cprint(f'Could not save the link manifest: {e.stderr.strip()}', 'red')
+
+    if args.report is not None:
+        report = build_report(link_sources, spelling_keys)
+        if args.report_format == 'junit':
+            write_junit_report(args.report, report)
+        else:
+            write_json_report(args.report, report)
+
+    rate_limiter.print_stats(args.verbose)
+    if args.verbose:
+        print_session_stats()
+        print_fallback_stats()
+
     # Return code > 0 to return error.
     num_broken = len(broken_links)
     if num_broken > 0:
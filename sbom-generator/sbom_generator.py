@@ -5,7 +5,15 @@ import yaml
 import sys
 import os
 import re
+import json
+import posixpath
 import hashlib
+import subprocess
+import copy
+import textwrap
+from functools import lru_cache, partial
+from itertools import chain
+from multiprocessing import Pool
 from datetime import datetime
 from pathlib import Path
 from enum import Enum
@@ -26,8 +34,62 @@ from spdx_tools.spdx.model import (
     ExtractedLicensingInfo,
 )
 from spdx_tools.common.spdx_licensing import spdx_licensing
+from spdx_tools.spdx.jsonschema.document_converter import DocumentConverter
+from spdx_tools.spdx.validation.document_validator import validate_full_spdx_document
+from spdx_tools.spdx.validation.file_validator import validate_file_within_document
+from spdx_tools.spdx.writer.tagvalue.creation_info_writer import write_creation_info
+from spdx_tools.spdx.writer.tagvalue.extracted_licensing_info_writer import (
+    write_extracted_licensing_info,
+)
+from spdx_tools.spdx.writer.tagvalue.file_writer import write_file as write_tagvalue_file
+from spdx_tools.spdx.writer.tagvalue.package_writer import write_package
+from spdx_tools.spdx.writer.tagvalue.relationship_writer import write_relationship
+from spdx_tools.spdx.writer.tagvalue.tagvalue_writer_helper_functions import (
+    write_list_of_elements,
+    write_optional_heading,
+    write_separator,
+)
 from spdx_tools.spdx.writer.write_anything import write_file
 
+# Files are read in chunks of this size, so memory use doesn't grow with file size.
+READ_CHUNK_SIZE = 1024 * 1024
+# Most text kept between slices when scanning a file for metadata, which bounds the
+# length of a match that can span slices.
+SCAN_MAX_CARRY = 64 * 1024
+# File content is scanned for metadata in slices of this size.
+SCAN_SLICE_SIZE = 16 * 1024
+# License and copyright headers are at the top of files, so by default only this many
+# bytes of each file are scanned.
+DEFAULT_SCAN_WINDOW = 64 * 1024
+# Files with a NUL byte in this many leading bytes are binary, and are not scanned.
+BINARY_SNIFF_SIZE = 8000
+# Version of the metadata kept in the hash cache. Caches of other versions are not reused.
+HASH_CACHE_VERSION = 3
+
+# Metadata detected in every file, with the pattern that finds it and a keyword that
+# starts every match. If the keyword is seen but the pattern doesn't match, the rest of
+# the file is scanned too.
+FILE_METADATA_PATTERNS = {
+    "license": (
+        re.compile(rb"SPDX-License-Identifier:\s*([A-Za-z0-9\-\.+]+)", re.IGNORECASE),
+        re.compile(rb"SPDX-License-Identifier", re.IGNORECASE),
+    ),
+    "copyright": (
+        re.compile(rb"(Copyright\s+.*?All\s+Rights\s+Reserved\.?)", re.IGNORECASE),
+        re.compile(rb"Copyright", re.IGNORECASE),
+    ),
+}
+
+# SBOM formats that can be written, and the file extension of each.
+OUTPUT_FORMATS = {
+    "tag-value": "spdx",
+    "json": "spdx.json",
+    "xml": "spdx.xml",
+    "yaml": "spdx.yaml",
+}
+# Formats that can be written while the file entries are produced.
+STREAMED_FORMATS = ("tag-value", "json")
+
 
 class DistributionType(Enum):
     ARCHIVE = "archive"
@@ -51,25 +113,177 @@ def convert_to_spdx_vcs_location(url):
     return url
 
 
-def detect_file_metadata(file_path, patterns):
-    """Detect metadata from file content using regex patterns."""
+class MetadataScanner:
+    """Searches file content for metadata patterns as it is read, one chunk at a time."""
+
+    def __init__(self, patterns, window=DEFAULT_SCAN_WINDOW):
+        self.pending = dict(patterns)
+        self.results = {key: SpdxNoAssertion() for key in patterns.keys()}
+        # Number of leading bytes to scan, or 0 to scan the whole file.
+        self.window = window
+        self.scanned = 0
+        self.carry = b""
+        self.done = False
+
+    def feed(self, data, final=False):
+        """Scan the next chunk of the file."""
+        for start in range(0, max(1, len(data)), SCAN_SLICE_SIZE):
+            if self.done:
+                return
+            self.scan(data[start : start + SCAN_SLICE_SIZE], final and start + SCAN_SLICE_SIZE >= len(data))
+
+    def scan(self, data, final):
+        """Scan a slice of the file."""
+        # Binary files are detected the way git does, by a NUL byte near the start.
+        if self.scanned == 0 and b"\0" in data[:BINARY_SNIFF_SIZE]:
+            self.done = True
+            return
+        text = self.carry + data
+        text_start = self.scanned - len(self.carry)
+        self.scanned += len(data)
+
+        # Only search complete lines, as a match can't be confirmed on a partial one.
+        end = len(text) if final else text.rfind(b"\n") + 1
+        keep = end
+        for key, (pattern, keyword) in list(self.pending.items()):
+            match = pattern.search(text, 0, end)
+            if match:
+                value = match.group(1) if match.groups() else match.group(0)
+                # Line endings are stored the way a file opened in text mode reads them.
+                text_value = value.decode("utf-8", errors="ignore")
+                self.results[key] = text_value.replace("\r\n", "\n").replace("\r", "\n")
+                del self.pending[key]
+                continue
+            seen = keyword.search(text)
+            if seen:
+                # Every match starts with the keyword, and one may span several lines
+                # and end in a later slice, so keep the text from the first keyword on.
+                keep = min(keep, seen.start())
+                if self.window and seen.start() < end:
+                    # Part of a header without a match, look for it in the whole file.
+                    self.window = 0
+        if not self.pending:
+            self.done = True
+            return
+
+        self.carry = text[keep:][-SCAN_MAX_CARRY:]
+
+        # Stop once the line that the window ends in has been searched.
+        if self.window and (
+            text_start + end >= self.window or self.scanned >= self.window + SCAN_MAX_CARRY
+        ):
+            self.done = True
+
+
+def scan_file(file_path, scan_window=DEFAULT_SCAN_WINDOW):
+    """Hash a file and detect its metadata from a single read of its content."""
+    sha1 = hashlib.sha1()
+    scanner = MetadataScanner(FILE_METADATA_PATTERNS, scan_window)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(READ_CHUNK_SIZE):
+            sha1.update(chunk)
+            scanner.feed(chunk)
+    scanner.feed(b"", final=True)
+    return {
+        "hash": sha1.hexdigest(),
+        "license": scanner.results["license"],
+        "copyright": scanner.results["copyright"],
+    }
+
+
+def git_blob_ids(directory):
+    """Return the git blob id of every file under directory whose content matches the
+    index, keyed by relative path. Empty if directory isn't in a git checkout."""
     try:
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
-
-        results = {}
-        for key, pattern in patterns.items():
-            match = re.search(pattern, content, re.IGNORECASE)
-            results[key] = (
-                match.group(1)
-                if match and match.groups()
-                else (match.group(0) if match else SpdxNoAssertion())
+        prefix, staged, status = [
+            subprocess.run(
+                ["git", "-C", str(directory)] + args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                encoding="utf-8",
+                check=True,
+            ).stdout
+            for args in (
+                ["rev-parse", "--show-prefix"],
+                ["ls-files", "-s", "-z", "--recurse-submodules"],
+                ["status", "--porcelain=v2", "-z", "--untracked-files=no", "--", "."],
             )
+        ]
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+    prefix = prefix.strip()
+
+    # Paths listed by ls-files are relative to directory.
+    blob_ids = {}
+    for entry in staged.split("\0"):
+        if entry:
+            info, path = entry.split("\t", 1)
+            _, blob_id, stage = info.split()
+            if stage == "0":
+                blob_ids[f"./{path}"] = blob_id
+
+    # Files changed in the working tree don't match their blob. Paths listed by status
+    # are relative to the top of the repository.
+    changed = []
+    entries = iter(status.split("\0"))
+    for entry in entries:
+        fields = entry.split(" ")
+        if entry.startswith("1 "):
+            path = entry.split(" ", 8)[8]
+        elif entry.startswith("2 "):
+            path = entry.split(" ", 9)[9]
+            # Renames are followed by the original path.
+            next(entries, None)
+        else:
+            continue
+        # Submodules are flagged as S<c><m><u>, with m set if they contain changes.
+        if fields[1][1] != "." or (fields[2].startswith("S") and fields[2][2] == "M"):
+            changed.append(f"./{path[len(prefix):]}")
+    for path in changed:
+        blob_ids.pop(path, None)
+        for blob_path in [p for p in blob_ids if p.startswith(f"{path}/")]:
+            del blob_ids[blob_path]
 
-        return results
+    return blob_ids
 
-    except Exception:
-        return {key: SpdxNoAssertion() for key in patterns.keys()}
+
+def load_hash_cache(cache_path, scan_window):
+    """Load the file information saved by a previous run."""
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        # Metadata found with a different scan window or version can't be reused.
+        if cache.get("version") == HASH_CACHE_VERSION and cache.get("scan_window") == scan_window:
+            return {"files": cache.get("files", {}), "blobs": cache.get("blobs", {})}
+    except (OSError, ValueError):
+        # A missing or corrupted cache only means that every file is hashed again.
+        pass
+    return {"files": {}, "blobs": {}}
+
+
+def save_hash_cache(cache_path, cache):
+    """Save file information so that the next run only hashes files that changed."""
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    # Replace the cache in one step so that an interrupted run can't corrupt it.
+    os.replace(tmp_path, cache_path)
+
+
+def cache_entry(file_info):
+    """Convert file information to the form kept in the hash cache."""
+    return {
+        key: None if isinstance(value, SpdxNoAssertion) else value
+        for key, value in file_info.items()
+    }
+
+
+def cached_file_info(entry):
+    """Convert an entry of the hash cache back to file information."""
+    return {
+        key: SpdxNoAssertion() if value is None else value
+        for key, value in entry.items()
+    }
 
 
 def extract_manifest(directory):
@@ -122,7 +336,60 @@ def extract_manifest(directory):
         raise FileNotFoundError("manifest.yml not found in the given directory.")
 
 
-def process_directory(directory, excluded_files=None):
+def normalize_relative_path(path):
+    """Normalize a path relative to the directory to the ./ form used in the SBOM."""
+    path = posixpath.normpath(path.replace(os.sep, "/"))
+    return "." if path == "." else f"./{path}"
+
+
+def walk_directory(directory, excluded_files):
+    """Walk directory and return the files to include, with their paths, and the
+    relative paths of the excluded files, both in the order of the walk."""
+    # Exclusions are matched with a single set lookup per directory and file.
+    excluded_paths = set(normalize_relative_path(exc) for exc in excluded_files)
+    included_files = []
+    excluded_file_list = []
+
+    # Walk depth first, listing the files of each directory before its subdirectories.
+    stack = [(str(directory), ".", False)]
+    while stack:
+        path, relative_dir, is_excluded = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        subdirectories = []
+        for entry in entries:
+            # Always ignore .git folders and .git files (including submodule .git files)
+            if entry.name == ".git":
+                continue
+            relative_path = f"{relative_dir}/{entry.name}"
+            # Everything in an excluded directory is excluded. Its files only need to
+            # be listed for the verification code.
+            entry_is_excluded = is_excluded or relative_path in excluded_paths
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append((entry.path, relative_path, entry_is_excluded))
+                elif entry.is_file():
+                    if entry_is_excluded:
+                        excluded_file_list.append(relative_path)
+                    else:
+                        included_files.append((relative_path, Path(entry.path)))
+            except OSError:
+                continue
+        stack.extend(reversed(subdirectories))
+
+    return included_files, excluded_file_list
+
+
+def process_directory(
+    directory,
+    excluded_files=None,
+    jobs=None,
+    hash_cache=None,
+    scan_window=DEFAULT_SCAN_WINDOW,
+):
     """Process directory and return manifest info and hashes."""
     directory = Path(directory)
     if excluded_files is None:
@@ -131,56 +398,97 @@ def process_directory(directory, excluded_files=None):
     # Extract manifest
     manifest = extract_manifest(directory)
 
-    excluded_file_list = []
+    included_files, excluded_file_list = walk_directory(directory, excluded_files)
+
+    # Reuse the information of files that haven't changed since the last run. Files
+    # are identified by their git blob id, which survives a fresh clone, or else by
+    # their path, size, modification time and inode.
     included_file_info = {}
+    cache_keys = {}
+    if hash_cache is not None:
+        cache = load_hash_cache(hash_cache, scan_window)
+        blob_ids = git_blob_ids(directory)
+        for relative_path, file_path in included_files:
+            stat = file_path.stat()
+            if relative_path in blob_ids:
+                key = ("blobs", f"{blob_ids[relative_path]}:{stat.st_size}")
+                entry = cache["blobs"].get(key[1])
+            else:
+                key = ("files", relative_path, [stat.st_size, stat.st_mtime_ns, stat.st_ino])
+                entry = cache["files"].get(relative_path)
+                entry = entry["info"] if entry and entry["key"] == key[2] else None
+            cache_keys[relative_path] = key
+            if entry is not None:
+                included_file_info[relative_path] = cached_file_info(entry)
+
+    # Hash the other files and scan them for metadata in parallel.
+    to_scan = [
+        (relative_path, file_path)
+        for relative_path, file_path in included_files
+        if relative_path not in included_file_info
+    ]
+    with Pool(jobs) as pool:
+        file_infos = pool.imap(
+            partial(scan_file, scan_window=scan_window),
+            [file_path for _, file_path in to_scan],
+            chunksize=16,
+        )
+        for (relative_path, _), file_info in zip(to_scan, file_infos):
+            included_file_info[relative_path] = file_info
+
+    # Keep the order of the walk.
+    included_file_info = {
+        relative_path: included_file_info[relative_path]
+        for relative_path, _ in included_files
+    }
+
+    if hash_cache is not None:
+        # Only keep the files of this run, so the cache doesn't grow forever.
+        new_cache = {
+            "version": HASH_CACHE_VERSION,
+            "scan_window": scan_window,
+            "files": {},
+            "blobs": {},
+        }
+        for relative_path, key in cache_keys.items():
+            entry = cache_entry(included_file_info[relative_path])
+            if key[0] == "blobs":
+                new_cache["blobs"][key[1]] = entry
+            else:
+                new_cache["files"][relative_path] = {"key": key[2], "info": entry}
+        save_hash_cache(hash_cache, new_cache)
+        hits = len(included_files) - len(to_scan)
+        print(
+            f"Hash cache: reused {hits} of {len(included_files)} files "
+            f"({100 * hits / max(1, len(included_files)):.1f}%)"
+        )
 
-    for file_path in directory.rglob("*"):
-        if file_path.is_file():
-            relative_path = f"./{file_path.relative_to(directory)}"
+    return manifest, included_file_info, excluded_file_list
 
-            # Always ignore .git folders and .git files (including submodule .git files)
-            if "/.git/" in relative_path or relative_path.endswith("/.git"):
-                continue
 
-            # Check if file should be excluded
-            is_excluded = False
-            for exc in excluded_files:
-                exc_path = directory / exc.lstrip("./")
-                if exc_path.is_dir():
-                    # Directory exclusion - check if file is within directory
-                    if (
-                        relative_path.startswith(f"./{exc.lstrip('./')}/")
-                        or relative_path == f"./{exc.lstrip('./')}"
-                    ):
-                        is_excluded = True
-                        break
-                else:
-                    # File exclusion - exact match
-                    if relative_path == exc:
-                        is_excluded = True
-                        break
+@lru_cache(maxsize=None)
+def parse_license(license_expression):
+    """Parse an SPDX license expression, reusing the result for expressions seen before."""
+    return spdx_licensing.parse(license_expression)
 
-            if is_excluded:
-                excluded_file_list.append(relative_path)
-            else:
-                with open(file_path, "rb") as f:
-                    file_data = f.read()
-                sha1_hash = hashlib.sha1(file_data).hexdigest()
-
-                metadata = detect_file_metadata(
-                    file_path,
-                    {
-                        "license": r"SPDX-License-Identifier:\s*([A-Za-z0-9\-\.+]+)",
-                        "copyright": r"(Copyright\s+.*?All\s+Rights\s+Reserved\.?)",
-                    },
-                )
-                included_file_info[relative_path] = {
-                    "hash": sha1_hash,
-                    "license": metadata["license"],
-                    "copyright": metadata["copyright"],
-                }
 
-    return manifest, included_file_info, excluded_file_list
+def iter_files(included_file_info):
+    """Create the SPDX file object of each included file, one at a time."""
+    for file_counter, (file_path, file_info) in enumerate(included_file_info.items(), 1):
+        file_license = file_info.get("license", SpdxNoAssertion())
+        file_copyright = file_info.get("copyright", SpdxNoAssertion())
+
+        yield File(
+            name=file_path,
+            spdx_id=f"SPDXRef-File-{file_counter}",
+            checksums=[Checksum(ChecksumAlgorithm.SHA1, file_info["hash"])],
+            license_concluded=(
+                file_license
+                if isinstance(file_license, SpdxNoAssertion)
+                else parse_license(file_license)
+            ),
+            copyright_text=file_copyright,
+        )
 
 
 def generate_sbom(
@@ -192,6 +500,12 @@ def generate_sbom(
     creator=None,
     document_namespace_prefix=None,
     include_file_hashes=False,
+    jobs=None,
+    hash_cache=None,
+    scan_window=DEFAULT_SCAN_WINDOW,
+    output_formats=None,
+    stream=False,
+    verbose=False,
 ):
     """Generate SBOM from directory."""
 
@@ -200,7 +514,7 @@ def generate_sbom(
     #  -get file information (hash, license, copyright text) for all file's that are not excluded.
     #  -get the relative paths of each file (from directory) that was excluded (needed for PackageVerificationCode)
     manifest, included_file_info, excluded_file_list = process_directory(
-        directory_path, excluded_files
+        directory_path, excluded_files, jobs, hash_cache, scan_window
     )
 
     # SBOM objects that will make up the SBOM document.
@@ -212,7 +526,7 @@ def generate_sbom(
     creation_info = CreationInfo(
         spdx_version="SPDX-2.3",
         spdx_id="SPDXRef-DOCUMENT",
-        name=f"",
+        name=f"{manifest['name']} {manifest['version']} {str(distribution_type)} SBOM",
         data_license="CC0-1.0",
         document_namespace="",
         creators=creators,
@@ -253,10 +567,10 @@ def generate_sbom(
 
     # Generate output filenames based on package info
     output_files = [
-        f"{manifest['name']}-{manifest['version']}-{str(distribution_type)}-SPDX2.3.spdx",
-        f"{manifest['name']}-{manifest['version']}-{str(distribution_type)}-SPDX2.3.spdx.json",
-        f"{manifest['name']}-{manifest['version']}-{str(distribution_type)}-SPDX2.3.spdx.xml",
-        f"{manifest['name']}-{manifest['version']}-{str(distribution_type)}-SPDX2.3.spdx.yaml",
+        f"{manifest['name']}-{manifest['version']}-{str(distribution_type)}-SPDX2.3.{OUTPUT_FORMATS[output_format]}"
+        for output_format in dict.fromkeys(
+            output_formats or OUTPUT_FORMATS
+        )
     ]
 
     # Calculate verification code for the main package
@@ -291,12 +605,12 @@ def generate_sbom(
     
     # Create concluded license
     if unique_licenses:
-        concluded_license = spdx_licensing.parse(" AND ".join(sorted(unique_licenses)))
+        concluded_license = parse_license(" AND ".join(sorted(unique_licenses)))
     else:
         concluded_license = (
             manifest["license"]
             if isinstance(manifest["license"], SpdxNoAssertion)
-            else spdx_licensing.parse(manifest["license"])
+            else parse_license(manifest["license"])
         )
 
     # Define the main software package of the given directory.
@@ -317,7 +631,7 @@ def generate_sbom(
         license_declared=(
             manifest["license"]
             if isinstance(manifest["license"], SpdxNoAssertion)
-            else spdx_licensing.parse(manifest["license"])
+            else parse_license(manifest["license"])
         ),
         homepage=homepage,
         source_info=source_info
@@ -332,35 +646,20 @@ def generate_sbom(
         Relationship("SPDXRef-DOCUMENT", RelationshipType.DESCRIBES, "SPDXRef-Package")
     ]
 
-    # Create file objects for the document if directed by CLI.
-    if include_file_hashes:
-        file_counter = 1
-        for file_path, file_info in included_file_info.items():
-            file_hash = file_info["hash"]
-            file_license = file_info.get("license", SpdxNoAssertion())
-            file_copyright = file_info.get("copyright", SpdxNoAssertion())
-
-            file_obj = File(
-                name=file_path,
-                spdx_id=f"SPDXRef-File-{file_counter}",
-                checksums=[Checksum(ChecksumAlgorithm.SHA1, file_hash)],
-                license_concluded=(
-                    file_license
-                    if isinstance(file_license, SpdxNoAssertion)
-                    else spdx_licensing.parse(file_license)
-                ),
-                copyright_text=file_copyright,
-            )
+    # Create file objects for the document if directed by CLI. When streaming,
+    # they are created again while each format is written instead.
+    streamed_file_info = None
+    if include_file_hashes and stream:
+        streamed_file_info = included_file_info
+    elif include_file_hashes:
+        for file_obj in iter_files(included_file_info):
             files.append(file_obj)
             # Create CONTAINS relationship between main package and file
             relationships.append(
                 Relationship(
-                    "SPDXRef-Package",
-                    RelationshipType.CONTAINS,
-                    f"SPDXRef-File-{file_counter}",
+                    "SPDXRef-Package", RelationshipType.CONTAINS, file_obj.spdx_id
                 )
             )
-            file_counter += 1
 
     # Create dependency packages and relationships. TODO - Cleanup and
     # make function for this.
@@ -403,12 +702,12 @@ def generate_sbom(
                 license_concluded=(
                     dep["license"]
                     if isinstance(dep["license"], SpdxNoAssertion)
-                    else spdx_licensing.parse(dep["license"])
+                    else parse_license(dep["license"])
                 ),
                 license_declared=(
                     dep["license"]
                     if isinstance(dep["license"], SpdxNoAssertion)
-                    else spdx_licensing.parse(dep["license"])
+                    else parse_license(dep["license"])
                 ),
             )
 
@@ -470,12 +769,12 @@ def generate_sbom(
                 license_concluded=(
                     dep["license"]
                     if isinstance(dep["license"], SpdxNoAssertion)
-                    else spdx_licensing.parse(dep["license"])
+                    else parse_license(dep["license"])
                 ),
                 license_declared=(
                     dep["license"]
                     if isinstance(dep["license"], SpdxNoAssertion)
-                    else spdx_licensing.parse(dep["license"])
+                    else parse_license(dep["license"])
                 ),
             )
 
@@ -496,26 +795,166 @@ def generate_sbom(
                     )
                 )
 
-    # Write SBOM in all formats with unique namespaces
+    # Each format gets its own document, which differs only in the namespace.
+    documents = []
     for output_path in output_files:
         # Set document namespace using prefix + filename
-        creation_info.name = (
-            f"{manifest['name']} {manifest['version']} {str(distribution_type)} SBOM"
-        )
-        creation_info.document_namespace = (
+        document_creation_info = copy.copy(creation_info)
+        document_creation_info.document_namespace = (
             f"{document_namespace_prefix.rstrip('/')}/{output_path}"
         )
+        documents.append(
+            Document(
+                creation_info=document_creation_info,
+                packages=packages,
+                files=files,
+                relationships=relationships,
+                extracted_licensing_info=extracted_licensing_info,
+            )
+        )
+
+    # Validate once, as the documents only differ in their namespaces.
+    validation_messages = validate_full_spdx_document(documents[0])
+    if streamed_file_info:
+        for file_obj in iter_files(streamed_file_info):
+            validation_messages.extend(
+                validate_file_within_document(file_obj, "SPDX-2.3", documents[0])
+            )
+    if validation_messages:
+        raise ValueError(
+            f"Document is not valid. The following errors were detected: {validation_messages}"
+        )
+
+    writer = write_sbom
+    if streamed_file_info:
+        writer = partial(write_streamed_sbom, included_file_info=streamed_file_info)
+
+    # Write the formats in parallel.
+    if len(documents) == 1 or jobs == 1:
+        for document, output_path in zip(documents, output_files):
+            writer(document, output_path)
+            print(f"SPDX v2 SBOM generated: {output_path}")
+    else:
+        with Pool(min(len(documents), jobs or os.cpu_count() or 1)) as pool:
+            for output_path in pool.starmap(writer, zip(documents, output_files)):
+                print(f"SPDX v2 SBOM generated: {output_path}")
+
+    if verbose:
+        cache_info = parse_license.cache_info()
+        print(
+            f"License expression cache: {cache_info.hits} hits, {cache_info.misses} misses"
+        )
+
+
+def write_sbom(document, output_path):
+    """Write an already validated SBOM document in the format given by its file name."""
+    write_file(document, output_path, validate=False)
+    return output_path
+
+
+def write_streamed_sbom(document, output_path, included_file_info):
+    """Write an already validated SBOM document, adding the included files as they are written.
+
+    Only one file object exists at a time, so memory use doesn't depend on the number of
+    files. Their CONTAINS relationships follow the DESCRIBES relationship, like in
+    documents that hold their files. Formats that can't be streamed are written from a
+    document holding all the files instead.
+    """
+    if not any(
+        output_path.endswith(f".{OUTPUT_FORMATS[output_format]}")
+        for output_format in STREAMED_FORMATS
+    ):
+        return write_sbom(add_files(document, included_file_info), output_path)
+    with open(output_path, "w", encoding="utf-8") as out:
+        if output_path.endswith(".json"):
+            write_streamed_json(document, out, included_file_info)
+        else:
+            write_streamed_tagvalue(document, out, included_file_info)
+    return output_path
+
+
+def add_files(document, included_file_info):
+    """Return a copy of a document that holds the included files and their relationships."""
+    files = list(iter_files(included_file_info))
+    document = copy.copy(document)
+    document.files = files
+    document.relationships = (
+        document.relationships[:1]
+        + [
+            Relationship("SPDXRef-Package", RelationshipType.CONTAINS, file_obj.spdx_id)
+            for file_obj in files
+        ]
+        + document.relationships[1:]
+    )
+    return document
+
+
+def write_streamed_tagvalue(document, out, included_file_info):
+    """Write a document in tag-value format, listing the included files after the main package."""
+    out.write("## Document Information\n")
+    write_creation_info(document.creation_info, out)
+    write_separator(out)
+
+    for package in document.packages:
+        write_package(package, out)
+        write_separator(out)
+        # Files listed after a package are contained by it.
+        if package.spdx_id == "SPDXRef-Package":
+            for file_obj in iter_files(included_file_info):
+                write_tagvalue_file(file_obj, out)
+                write_separator(out)
+
+    write_optional_heading(
+        document.extracted_licensing_info, "## License Information\n", out
+    )
+    write_list_of_elements(
+        document.extracted_licensing_info,
+        write_extracted_licensing_info,
+        out,
+        with_separator=True,
+    )
+
+    write_optional_heading(document.relationships, "## Relationships\n", out)
+    write_list_of_elements(document.relationships, write_relationship, out)
+    write_separator(out)
+
 
-        document = Document(
-            creation_info=creation_info,
-            packages=packages,
-            files=files,
-            relationships=relationships,
-            extracted_licensing_info=extracted_licensing_info,
+def write_streamed_json(document, out, included_file_info):
+    """Write a document in JSON format, adding the included files and their relationships."""
+    converter = DocumentConverter()
+    document_dict = converter.convert(document)
+    describes, *relationships = document_dict.pop("relationships")
+
+    # Everything but the streamed arrays, without the closing brace.
+    out.write(json.dumps(document_dict, indent=4)[:-2])
+
+    if included_file_info:
+        write_json_array(
+            out,
+            "files",
+            (
+                converter.file_converter.convert(file_obj, document)
+                for file_obj in iter_files(included_file_info)
+            ),
+        )
+    contains = (
+        converter.relationship_converter.convert(
+            Relationship("SPDXRef-Package", RelationshipType.CONTAINS, file_obj.spdx_id)
         )
+        for file_obj in iter_files(included_file_info)
+    )
+    write_json_array(out, "relationships", chain([describes], contains, relationships))
+    out.write("\n}")
+
 
-        write_file(document, output_path, validate=True)
-        print(f"SPDX v2 SBOM generated: {output_path}")
+def write_json_array(out, key, items):
+    """Write a member of the top-level JSON object whose items are produced one at a time."""
+    out.write(f",\n    {json.dumps(key)}: [")
+    separator = "\n"
+    for item in items:
+        out.write(separator + textwrap.indent(json.dumps(item, indent=4), " " * 8))
+        separator = ",\n"
+    out.write("]" if separator == "\n" else "\n    ]")
 
 
 def main():
@@ -548,6 +987,40 @@ def main():
         action="append",
         help="Exclude files/directories from verification code (can be used multiple times)",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of processes used to hash files (defaults to the number of CPUs)",
+    )
+    parser.add_argument(
+        "--hash-cache",
+        help="Path to file used to keep file hashes, licenses and copyrights between runs",
+    )
+    parser.add_argument(
+        "--scan-window",
+        type=int,
+        default=DEFAULT_SCAN_WINDOW,
+        help="Number of leading bytes of each file to scan for license and copyright "
+        "headers, or 0 to scan whole files",
+    )
+    parser.add_argument(
+        "--format",
+        dest="formats",
+        action="append",
+        choices=list(OUTPUT_FORMATS),
+        help="SBOM format to write (can be used multiple times, defaults to all formats)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write file entries as they are created instead of building the whole "
+        "document in memory (tag-value and JSON formats only, other formats are still "
+        "written from the whole document)",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Print license cache statistics"
+    )
     parser.add_argument(
         "-d", "--download-location", required=True, help="Package download location URL"
     )
@@ -566,6 +1039,12 @@ def main():
         args.creator,
         args.namespace_prefix,
         args.include_file_hashes,
+        args.jobs,
+        args.hash_cache,
+        args.scan_window,
+        args.formats,
+        args.stream,
+        args.verbose,
     )
 
 